@@ -0,0 +1,54 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import tracing
+from rollup import NON_SPEND_CATEGORIES
+
+
+# --- MULTI-YEAR ANALYTICS ---
+# Read from the Arrow snapshots (snapshots.py): only the year, month, owner, category and cents
+# columns are touched, years outside the range skip their files, and the grouping runs in
+# Arrow. What comes back to pandas is one row per (year, month, owner, category).
+@tracing.traced("analytics.monthly")
+def monthly(snapshots, first_year, last_year, owner=None):
+    table = snapshots.read(["year", "month", "owner", "category", "cents"], first_year, last_year)
+    keep = pc.and_(pc.greater_equal(table["year"], first_year), pc.less_equal(table["year"], last_year))
+    if owner:
+        keep = pc.and_(keep, pc.equal(table["owner"].cast(pa.string()), owner))
+    grouped = table.filter(keep).group_by(["year", "month", "owner", "category"]).aggregate([("cents", "sum")])
+    df = grouped.to_pandas()
+    for col in ("owner", "category"):
+        df[col] = df[col].astype(str)
+    return df.rename(columns={"cents_sum": "cents"})
+
+
+def _spending(df):
+    return df[~df["category"].isin(NON_SPEND_CATEGORIES)]
+
+
+# Spend per category, one row per month ("2024-03"), in dollars
+def category_by_month(df):
+    spend = _spending(df)
+    months = spend["year"].astype(int).astype(str) + "-" + spend["month"].astype(int).map("{:02d}".format)
+    table = spend.assign(month_key=months).pivot_table(
+        index="month_key", columns="category", values="cents", aggfunc="sum", fill_value=0
+    )
+    return (table / 100).rename_axis(index=None, columns=None)
+
+
+# Income and spend per owner over the whole range, in dollars
+def owner_breakdown(df):
+    spend = _spending(df).groupby("owner")["cents"].sum()
+    income = df[df["category"] == "Income"].groupby("owner")["cents"].sum()
+    out = pd.DataFrame({"Income": income, "Spend": spend}).fillna(0) / 100
+    return out.rename_axis(index=None)
+
+
+# Spend per calendar month (1-12), one column per year, to compare the same month across years
+def year_over_year(df):
+    spend = _spending(df)
+    table = spend.pivot_table(index="month", columns="year", values="cents", aggfunc="sum", fill_value=0)
+    table = table.reindex(range(1, 13), fill_value=0) / 100
+    table.columns = [str(int(y)) for y in table.columns]
+    return table.rename_axis(index="Month")
@@ -1,15 +1,21 @@
+import importlib
+import threading
 import streamlit as st
 import streamlit.components.v1 as components
-import pandas as pd
-import gspread
 import pytz
-import time
-from oauth2client.service_account import ServiceAccountCredentials
 from datetime import date, datetime
+import tracing
 
 # --- CONFIGURATION ---
 SHEET_NAME = "Financial Blueprint - Jimmy & Lily" 
 CALGARY_TZ = pytz.timezone('America/Edmonton')
+CACHE_TTL = 300  # seconds the shared worksheet frames are trusted before syncing with the sheet again
+LIVE_UPDATE_INTERVAL = 3  # seconds between checks for saves made in the other person's session
+TABS = ["➕ Add Entry", "⚡ Quick Add", "🏦 Balances", "📜 History"]
+# Imported behind the PIN (pandas, gspread and the app modules built on them); see warm_imports
+HEAVY_MODULES = ("pandas", "gspread", "rollup", "schema", "balances", "ledger", "partitions", "mirror",
+                 "scheduler", "sheets", "outbox", "store", "categorize", "history", "importer",
+                 "shortcuts", "snapshots", "analytics")
 
 # PHONE FRIENDLY: Collapsed sidebar
 st.set_page_config(
@@ -17,9 +23,29 @@ st.set_page_config(
     layout="centered", 
     initial_sidebar_state="collapsed"
 )
+# PIN screen runs are timed as "pin.run", everything after the PIN as "app.run"
+tracing.start_run("app" if st.session_state.get("password_correct") else "pin")
+
+# --- STARTUP ---
+# The PIN screen only needs Streamlit: no theme, no script, no pandas or gspread, so it paints
+# just as fast on a cold container whatever the size of the ledger. The first PIN screen of a
+# process starts importing the rest in the background while the PIN is being typed.
+@st.cache_resource(show_spinner=False)
+def warm_imports():
+    def run():
+        with tracing.span("app.warm_imports"):
+            for name in HEAVY_MODULES:
+                try:
+                    importlib.import_module(name)
+                except Exception:
+                    pass  # raised again, and shown, by the import after the PIN
+    thread = threading.Thread(target=run, name="warm-imports", daemon=True)
+    thread.start()
+    return thread
 
 # --- CUSTOM CSS (Bell Theme: White BG, Blue Text, Outline Buttons) ---
-st.markdown("""
+def inject_theme():
+    st.markdown("""
     <style>
     .stApp { background-color: #FFFFFF; }
     h1, h2, h3, h4, h5, h6, p, label, .stMarkdown, div[data-testid="stMetricLabel"] { 
@@ -77,6 +103,16 @@ def inject_mobile_logic():
         </script>
     """, height=0, width=0)
 
+# The PIN screen only needs the number pad: one pass over the PIN field, no observer
+def inject_pin_keypad():
+    components.html("""
+        <script>
+            window.parent.document.querySelectorAll('input[type="password"]').forEach(input => {
+                input.setAttribute('inputmode', 'decimal');
+            });
+        </script>
+    """, height=0, width=0)
+
 # --- SECURITY & USER DETECTION ---
 def check_password():
     def password_entered():
@@ -94,68 +130,161 @@ def check_password():
 
     if "password_correct" not in st.session_state:
         st.text_input("Enter Your PIN", type="password", max_chars=4, on_change=password_entered, key="password")
-        inject_mobile_logic() 
+        inject_pin_keypad()
+        warm_imports()
         return False
     elif not st.session_state["password_correct"]:
         st.text_input("Enter Your PIN", type="password", max_chars=4, on_change=password_entered, key="password")
+        inject_pin_keypad()
         st.error("😕 Incorrect PIN")
-        inject_mobile_logic() 
         return False
     else:
         return True
 
 if check_password():
     current_user = st.session_state.get("current_user", "Joint")
+
+    # Usually already loaded by warm_imports while the PIN was typed
+    with tracing.span("app.imports"):
+        import pandas as pd
+        import analytics
+        import balances
+        import categorize
+        import history
+        import importer
+        import ledger
+        import partitions
+        import rollup
+        import schema
+        import shortcuts
+        import store
+        from mirror import get_mirror
+        from outbox import get_outbox
+        from scheduler import is_quota_error
+        from sheets import get_sheets, is_auth_error
+        from snapshots import get_snapshots
+    inject_theme()
     
-    # --- GOOGLE SHEETS CONNECTION ---
-    def get_google_sheet_data():
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds_dict = dict(st.secrets["gcp_service_account"])
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        client = gspread.authorize(creds)
-        sheet = client.open(SHEET_NAME)
-        return sheet
-
-    try:
-        sheet = get_google_sheet_data()
-        trans_ws = sheet.worksheet("Transaction")
-        accounts_ws = sheet.worksheet("Accounts")
-        
-        # Load Accounts
-        accounts_df = pd.DataFrame(accounts_ws.get_all_records())
-        if not accounts_df.empty:
-            accounts_df.columns = accounts_df.columns.str.strip() 
-            accounts_df['DisplayName'] = (
-                accounts_df.get('Owner', pd.Series(['Unknown']*len(accounts_df))) + " - " + 
-                accounts_df.get('Account', pd.Series(['Unknown']*len(accounts_df)))
-            )
-            account_options = accounts_df['DisplayName'].unique().tolist()
-        else:
-            account_options = []
+    # A full run shows everything up to now; only changes after this point need another rerun
+    store.subscription().take()
 
-        # Load Transactions
-        trans_df = pd.DataFrame(trans_ws.get_all_records())
-        if not trans_df.empty:
-            trans_df.columns = trans_df.columns.str.strip() 
-        
-        # Load Frequent Transactions (New Sheet)
+    # --- GOOGLE SHEETS CONNECTION ---
+    # The ledger and accounts are synced on every run; the other sheets only when a tab that
+    # shows them is open (see the tabs below), so a run never waits on sheets it won't draw
+    def connected(load):
         try:
-            freq_ws = sheet.worksheet("Frequent Transactions")
-            freq_df = pd.DataFrame(freq_ws.get_all_records())
-            if not freq_df.empty:
-                freq_df.columns = freq_df.columns.str.strip()
-        except:
-            freq_df = pd.DataFrame() 
-
-    except Exception as e:
-        st.error(f"Error connecting to Google Sheets: {e}")
-        st.stop()
+            try:
+                return load(get_sheets(SHEET_NAME))
+            except Exception as e:
+                if not is_auth_error(e): raise
+                # Token revoked or expired under us: rebuild the shared client once and retry
+                get_sheets(SHEET_NAME).connect()
+                return load(get_sheets(SHEET_NAME))
+        except Exception as e:
+            if is_quota_error(e):
+                st.error("⏳ Google Sheets is busy (too many requests this minute). Wait a moment and refresh.")
+            else:
+                st.error(f"Error connecting to Google Sheets: {e}")
+            st.stop()
+
+    # (sheet, ttl) for what the open tab reads besides the ledger and accounts
+    def tab_sheets(sheets):
+        archives = [(name, partitions.ARCHIVE_TTL) for name in partitions.archives(sheets.titles())]
+        return {
+            TABS[0]: [(categorize.RULES_SHEET, CACHE_TTL)],
+            TABS[1]: [("Frequent Transactions", CACHE_TTL)],
+            TABS[2]: archives,
+            TABS[3]: [(categorize.RULES_SHEET, CACHE_TTL)] + archives,
+        }[st.session_state.get("main_tab", TABS[0])]
+
+    def load_ledger(sheets):
+        with tracing.span("app.load", part="ledger"):
+            sheets.health_check()
+
+            # The ledger, the accounts and the open tab's sheets in one values request; the
+            # loaders below then find their sheets fresh and build frames from the mirror
+            accounts_ws = sheets.worksheet("Accounts")
+            titles = sheets.titles()
+            store.sync_all(sheets, [(sheets.worksheet("Transaction"), CACHE_TTL), (accounts_ws, CACHE_TTL)] + [
+                (sheets.worksheet(name), ttl) for name, ttl in tab_sheets(sheets) if name in titles
+            ])
+
+            # Load Accounts
+            accounts_df = store.load_frame(accounts_ws, CACHE_TTL)
+            if not accounts_df.empty:
+                accounts_df['DisplayName'] = (
+                    accounts_df.get('Owner', pd.Series(['Unknown']*len(accounts_df))) + " - " + 
+                    accounts_df.get('Account', pd.Series(['Unknown']*len(accounts_df)))
+                )
+                account_options = accounts_df['DisplayName'].unique().tolist()
+            else:
+                account_options = []
+        return account_options
+
+    # The tabs query the mirror; only the importer needs frames of the ledger: the hot sheet
+    # and every archive whose year falls between start and end
+    def load_ledger_frames(sheets, start, end):
+        frames = [store.load_frame(sheets.worksheet("Transaction"), CACHE_TTL)]
+        archived = partitions.partitions(sheets.titles(), start, end)[1:]
+        if archived:
+            store.sync_all(sheets, [(sheets.worksheet(name), partitions.ARCHIVE_TTL) for name in archived])
+            frames += [store.load_frame(sheets.worksheet(name), partitions.ARCHIVE_TTL) for name in archived]
+        return frames
+
+    # Load Frequent Transactions (New Sheet)
+    def load_shortcuts(sheets):
+        with tracing.span("app.load", part="shortcuts"):
+            try:
+                freq_ws = sheets.worksheet("Frequent Transactions")
+                store.load_frame(freq_ws, CACHE_TTL)
+            except:
+                freq_ws = None
+        return freq_ws
+
+    # Closed years live in their own sheets (see partitions.py); they only change when a
+    # year is archived, so they are synced rarely
+    def load_archives(sheets):
+        with tracing.span("app.load", part="archives"):
+            store.sync_all(sheets, [
+                (sheets.worksheet(name), partitions.ARCHIVE_TTL) for name in partitions.archives(sheets.titles())
+            ])
+
+    # Load Category Rules (optional sheet: Pattern | Category)
+    def load_rules(sheets):
+        with tracing.span("app.load", part="rules"):
+            try:
+                rules_ws = sheets.worksheet(categorize.RULES_SHEET)
+                rules_df = store.load_frame(rules_ws, CACHE_TTL)
+            except:
+                rules_ws = None
+                rules_df = pd.DataFrame()
+        return rules_ws, rules_df, categorize.get_categorizer(categorize.rules_from(rules_df))
+
+    account_options = connected(load_ledger)
+
+    mirror_db = get_mirror()
+    outbox = get_outbox()
+    outbox.start(get_sheets(SHEET_NAME))
+    ledger.ensure_ids(mirror_db, outbox, current_user)
+    # Move closed years out of the Transaction sheet, checked once per ledger version
+    if st.session_state.get("archive_checked") != mirror_db.version(partitions.HOT_SHEET):
+        today = datetime.now(CALGARY_TZ).date()
+        if partitions.closed_years(mirror_db, today):
+            connected(load_archives)  # rows go after what an existing archive sheet already holds
+        archived = partitions.archive_closed_years(mirror_db, outbox, today, current_user)
+        st.session_state.archive_checked = mirror_db.version(partitions.HOT_SHEET)
+        if archived:
+            st.session_state.flash_message = "📦 Archived " + ", ".join(
+                f"{year} ({n} transactions) to \"{partitions.archive_name(year)}\"" for year, n in archived.items()
+            )
+            st.rerun()
 
     account_options.sort()
     from_options = ["External Source"] + account_options
     to_options = ["External Merchant"] + account_options
     owner_options = ["Jimmy", "Lily", "Joint"]
     cat_options = ["Food/Groceries", "Housing", "Childcare", "Debt Repayment", "Transportation", "Shopping", "Income", "Transfer", "Other"]
+    AUTO_CATEGORY = "✨ Auto (from rules)"
 
     # --- HELPER FUNCTIONS ---
     def get_index(options, value):
@@ -179,15 +308,35 @@ if check_password():
             if short_name in opt: return opt
         return options[0]
 
+    # Messages shown on the next run, so a write can st.rerun() right away
+    def flash(message):
+        st.session_state.flash_message = message
+
+    # Writes go to the outbox and are pushed to the sheet in the background
+    def queue_write(sheet, op, summary, **payload):
+        outbox.enqueue(sheet, op, payload, summary, current_user)
+
+    # Compare-and-swap bookkeeping: the version of a transaction when a picker first showed it.
+    # None means the pick changed in this very run (e.g. rows moved), so nothing is confirmed yet.
+    def seen_version(picker, txn):
+        seen = st.session_state.setdefault("seen_versions", {})
+        if seen.get(picker, (None,))[0] != txn['Key']:
+            seen[picker] = (txn['Key'], txn['_hash'])
+            return None
+        return seen[picker][1]
+
+    def cas_failed(picker):
+        st.session_state.seen_versions.pop(picker, None)
+        st.error("🚫 This transaction changed since you picked it (maybe edited on another phone). Check it and try again.")
+
     # --- CORE SAVE LOGIC ---
     def save_transaction(date_obj, owner_val, from_val, to_val, cat_val, desc_val, amount_val):
         if amount_val is None or amount_val == 0:
             st.error("🚫 Invalid Amount")
             return
 
-        final_amount = round(float(amount_val), 2)
-        all_values = trans_ws.get_all_values()
-        next_row = len(all_values) + 1
+        # Whole cents, the same rounding the typed ledger frame uses
+        final_amount = schema.cents_of(amount_val) / 100
         
         is_transfer = (from_val != "External Source") and (to_val != "External Merchant")
 
@@ -198,9 +347,8 @@ if check_password():
             owner_to, account_to = parse_account_string(to_val, owner_val)
             row_deposit = [str(date_obj), owner_to, "", account_to, "Transfer", desc_val, final_amount]
             
-            trans_ws.update(range_name=f"A{next_row}:G{next_row}", values=[row_withdrawal])
-            trans_ws.update(range_name=f"A{next_row+1}:G{next_row+1}", values=[row_deposit])
-            st.success(f"✅ Saved Transfer: {desc_val}")
+            new_rows = [row_withdrawal, row_deposit]
+            saved_msg = f"✅ Saved Transfer: {desc_val}"
         else:
             final_category = cat_val
             if from_val == "External Source": final_category = "Income"
@@ -213,319 +361,592 @@ if check_password():
             save_to = row_to_acc if to_val != "External Merchant" else "External Merchant"
             
             new_row = [str(date_obj), owner_val, save_from, save_to, final_category, desc_val, final_amount]
-            trans_ws.update(range_name=f"A{next_row}:G{next_row}", values=[new_row])
-            st.success(f"✅ Saved: {desc_val} (${final_amount})")
-        
-        time.sleep(1.0)
+            new_rows = [new_row]
+            saved_msg = f"✅ Saved: {desc_val} (${final_amount})"
+
+        new_rows = ledger.with_ids(new_rows, mirror_db.columns("Transaction"))
+        # One append for both legs of a transfer, no read of the ledger first
+        queue_write("Transaction", "append", saved_msg.removeprefix("✅ "),
+                    rows=new_rows, start_row=mirror_db.row_count("Transaction") + 2,
+                    id_col=ledger.id_col(mirror_db.columns("Transaction")))
+        store.append_rows("Transaction", new_rows)
+        flash(saved_msg)
         st.rerun()
 
+    # --- LIVE UPDATES ---
+    # Saves from another session update the shared store and notify this one; rerun to show them
+    @st.fragment(run_every=LIVE_UPDATE_INTERVAL)
+    def watch_for_changes():
+        if store.subscription().take():
+            st.rerun(scope="app")
+
     # --- APP INTERFACE ---
     st.title(f"💰 {current_user}'s Finance View")
+    inject_mobile_logic()
+    watch_for_changes()
+    if st.session_state.get("flash_message"):
+        st.success(st.session_state.pop("flash_message"))
+    if st.session_state.pop("quota_limited", False):
+        st.warning("⏳ Google Sheets is busy right now, showing the last synced data. Saves are queued and will go through.")
     
     if st.sidebar.button("🔒 Lock App"):
         del st.session_state["password_correct"]
         st.rerun()
 
+    if st.sidebar.button("🔄 Refresh from Sheet"):
+        store.invalidate()
+        get_sheets(SHEET_NAME).forget_listing()  # look again for newly added sheets
+        st.rerun()
+
+    # --- SYNC STATUS ---
+    sync_entries = outbox.recent(10)
+    pending_count = sum(1 for e in sync_entries if e['status'] == 'pending')
+    failed_count = sum(1 for e in sync_entries if e['status'] == 'failed')
+    # Failed writes need a Retry or Discard, so they are counted (and shown) on their own
+    sync_parts = []
+    if pending_count: sync_parts.append(f"{pending_count} pending")
+    if failed_count: sync_parts.append(f"⚠️ {failed_count} failed")
+    sync_label = ", ".join(sync_parts)
+    with st.sidebar.expander(f"☁️ Sync ({sync_label})" if sync_label else "☁️ Sync (all saved)", expanded=bool(failed_count)):
+        if not sync_entries:
+            st.caption("Nothing written yet.")
+        for entry in sync_entries:
+            icon = {"pending": "⏳", "synced": "✅", "failed": "⚠️"}[entry['status']]
+            st.caption(f"{icon} {entry['summary'] or entry['op']} · {entry['user']}")
+            if entry['status'] == "pending" and entry['attempts']:
+                st.caption(f"Retrying ({entry['attempts']}): {entry['last_error']}")
+            elif entry['status'] == "failed":
+                st.error(entry['last_error'])
+                rc1, rc2 = st.columns(2)
+                if rc1.button("Retry", key=f"retry_{entry['id']}"):
+                    outbox.retry(entry['id'])
+                    st.rerun()
+                if rc2.button("Discard", key=f"discard_{entry['id']}"):
+                    outbox.discard(entry['id'])
+                    store.invalidate()
+                    st.rerun()
+
     # TABS
-    tab1, tab2, tab3, tab4 = st.tabs(["➕ Add Entry", "⚡ Quick Add", "🏦 Balances", "📜 History"])
+    # Only the open tab runs, and the sheets it needs are loaded when it opens; switching tabs reruns
+    tab1, tab2, tab3, tab4 = st.tabs(TABS, key="main_tab", on_change="rerun")
 
     # --- TAB 1: MANUAL FORM ---
-    with tab1:
-        st.subheader("New Transaction")
-        with st.form("add_transaction_form", clear_on_submit=True):
-            c_ratio = [3, 7]
-            c1, c2 = st.columns(c_ratio)
-            with c1: st.markdown("**Date**")
-            with c2: date_input = st.date_input("Date", get_current_date(), label_visibility="collapsed")
-            
-            c1, c2 = st.columns(c_ratio)
-            with c1: st.markdown("**Owner**")
-            with c2: 
-                default_owner_idx = get_index(owner_options, current_user)
-                owner_input = st.selectbox("Owner", owner_options, index=default_owner_idx, label_visibility="collapsed")
+    if tab1.open:
+        with tab1:
+            st.subheader("New Transaction")
+            rules_ws, rules_df, categorizer = connected(load_rules)
+
+            with st.form("add_transaction_form", clear_on_submit=True):
+                c_ratio = [3, 7]
+                c1, c2 = st.columns(c_ratio)
+                with c1: st.markdown("**Date**")
+                with c2: date_input = st.date_input("Date", get_current_date(), label_visibility="collapsed")
             
-            c1, c2 = st.columns(c_ratio)
-            with c1: st.markdown("**Amount ($)**")
-            with c2: amount = st.number_input("Amount", min_value=0.0, step=0.01, format="%.2f", value=None, placeholder="0.00", label_visibility="collapsed")
+                c1, c2 = st.columns(c_ratio)
+                with c1: st.markdown("**Owner**")
+                with c2: 
+                    default_owner_idx = get_index(owner_options, current_user)
+                    owner_input = st.selectbox("Owner", owner_options, index=default_owner_idx, label_visibility="collapsed")
             
-            inject_mobile_logic()
-
-            c1, c2 = st.columns(c_ratio)
-            with c1: st.markdown("**From**")
-            with c2:
-                default_from_val = "External Source"
-                if current_user == "Jimmy": default_from_val = "Jimmy - Credit Card"
-                elif current_user == "Lily": default_from_val = "Lily - Credit Card"
-                from_idx = get_index(from_options, default_from_val)
-                payment_from = st.selectbox("From", from_options, index=from_idx, label_visibility="collapsed")
+                c1, c2 = st.columns(c_ratio)
+                with c1: st.markdown("**Amount ($)**")
+                with c2: amount = st.number_input("Amount", min_value=0.0, step=0.01, format="%.2f", value=None, placeholder="0.00", label_visibility="collapsed")
+
+                c1, c2 = st.columns(c_ratio)
+                with c1: st.markdown("**From**")
+                with c2:
+                    default_from_val = "External Source"
+                    if current_user == "Jimmy": default_from_val = "Jimmy - Credit Card"
+                    elif current_user == "Lily": default_from_val = "Lily - Credit Card"
+                    from_idx = get_index(from_options, default_from_val)
+                    payment_from = st.selectbox("From", from_options, index=from_idx, label_visibility="collapsed")
             
-            c1, c2 = st.columns(c_ratio)
-            with c1: st.markdown("**To**")
-            with c2: payment_to = st.selectbox("To", to_options, index=0, label_visibility="collapsed")
+                c1, c2 = st.columns(c_ratio)
+                with c1: st.markdown("**To**")
+                with c2: payment_to = st.selectbox("To", to_options, index=0, label_visibility="collapsed")
             
-            c1, c2 = st.columns(c_ratio)
-            with c1: st.markdown("**Category**")
-            with c2: category = st.selectbox("Category", cat_options, index=get_index(cat_options, "Transfer"), label_visibility="collapsed")
+                c1, c2 = st.columns(c_ratio)
+                with c1: st.markdown("**Category**")
+                with c2:
+                    # With rules set up, the category is picked from the note when the form is submitted
+                    form_cat_options = [AUTO_CATEGORY] + cat_options if len(categorizer) else cat_options
+                    default_cat = AUTO_CATEGORY if len(categorizer) else "Transfer"
+                    category = st.selectbox("Category", form_cat_options, index=get_index(form_cat_options, default_cat), label_visibility="collapsed")
             
-            c1, c2 = st.columns(c_ratio)
-            with c1: st.markdown("**Note**")
-            with c2: desc = st.text_input("Description", placeholder="e.g. E-Transfer", label_visibility="collapsed")
+                c1, c2 = st.columns(c_ratio)
+                with c1: st.markdown("**Note**")
+                with c2: desc = st.text_input("Description", placeholder="e.g. E-Transfer", label_visibility="collapsed")
             
-            st.markdown("###") 
-            submitted = st.form_submit_button("Submit Transaction", use_container_width=True)
-
-            if submitted:
-                if amount is None:
-                    st.error("🚫 Please enter an amount.")
-                elif payment_from == "External Source" and payment_to == "External Merchant":
-                    st.error("🚫 Invalid transaction.")
-                elif payment_from == payment_to:
-                     st.error("🚫 Invalid: Same account.")
-                else:
-                    save_transaction(date_input, owner_input, payment_from, payment_to, category, desc, amount)
+                st.markdown("###") 
+                submitted = st.form_submit_button("Submit Transaction", use_container_width=True)
+
+                if submitted:
+                    if amount is None:
+                        st.error("🚫 Please enter an amount.")
+                    elif payment_from == "External Source" and payment_to == "External Merchant":
+                        st.error("🚫 Invalid transaction.")
+                    elif payment_from == payment_to:
+                         st.error("🚫 Invalid: Same account.")
+                    else:
+                        if category == AUTO_CATEGORY:
+                            category = categorizer.suggest(desc) or "Transfer"
+                        save_transaction(date_input, owner_input, payment_from, payment_to, category, desc, amount)
+
+            # --- BULK IMPORT ---
+            with st.expander("📥 Import Bank Statement (CSV / OFX)", expanded=False):
+                statement = st.file_uploader("Statement file", type=["csv", "ofx", "qfx"], key="import_file")
+                if statement is not None:
+                    try:
+                        statement_df = importer.read_statement(statement.name, statement.getvalue())
+                    except Exception as e:
+                        st.error(f"🚫 Couldn't read {statement.name}: {e}")
+                        statement_df = None
+
+                    if statement_df is not None and not account_options:
+                        st.warning("Add accounts to the Accounts sheet before importing.")
+                    elif statement_df is not None and statement_df.empty:
+                        st.info("No transactions found in this file.")
+                    elif statement_df is not None:
+                        # One mapping per account named in the file (or one for the whole file)
+                        account_for_source = {}
+                        for source in statement_df['Source'].unique():
+                            guess = importer.guess_account(source, account_options, parse_account_string)
+                            account_for_source[source] = st.selectbox(
+                                f"Account for \"{source}\"" if source else "Account",
+                                account_options, index=get_index(account_options, guess), key=f"import_acc_{source}"
+                            )
+                        spend_cat = st.selectbox("Category for spending", cat_options, index=get_index(cat_options, "Shopping"), key="import_cat")
+
+                        rule_cats = categorizer.classify(statement_df['Description'])
+                        if rule_cats.notna().any():
+                            st.caption(f"✨ {int(rule_cats.notna().sum())} rows categorized by your rules")
+                        import_rows = importer.to_ledger_rows(statement_df, account_for_source, parse_account_string, current_user, spend_cat, rule_cats)
+                        start, end = statement_df['Date'].min(), statement_df['Date'].max()
+                        import_rows, dup_count = importer.drop_existing(
+                            import_rows, connected(lambda sheets: load_ledger_frames(sheets, start, end))
+                        )
+                        st.caption(f"{len(import_rows)} new · {dup_count} already in the ledger")
+                        st.dataframe(import_rows, use_container_width=True, hide_index=True, height=240)
+
+                        if len(import_rows) and st.button(f"📥 Import {len(import_rows)} Transactions", type="primary", use_container_width=True):
+                            new_rows = ledger.with_ids(import_rows.values.tolist(), mirror_db.columns("Transaction"))
+                            # Every row in one append request
+                            queue_write("Transaction", "append", f"Import {len(new_rows)} from {statement.name}",
+                                        rows=new_rows, start_row=mirror_db.row_count("Transaction") + 2,
+                                        id_col=ledger.id_col(mirror_db.columns("Transaction")))
+                            store.append_rows("Transaction", new_rows)
+                            flash(f"✅ Imported {len(new_rows)} transactions from {statement.name}")
+                            st.rerun()
 
     # --- TAB 2: QUICK ADD (WITH CONFIRMATION) ---
-    with tab2:
-        st.subheader("⚡ Frequent Transactions")
+    if tab2.open:
+        with tab2:
+            st.subheader("⚡ Frequent Transactions")
+            freq_ws = connected(load_shortcuts)
         
-        # Initialize session state for confirmation
-        if "pending_quick_add" not in st.session_state:
-            st.session_state.pending_quick_add = None
+            if freq_ws is not None:
+                shortcut_index = store.derived("Frequent Transactions", "shortcuts", shortcuts.build_index)
+            else:
+                shortcut_index = shortcuts.build_index(pd.DataFrame())
+
+            # Initialize session state for confirmation
+            if "pending_quick_add" not in st.session_state:
+                st.session_state.pending_quick_add = None
 
-        # 1. DISPLAY CONFIRMATION BOX (If pending)
-        if st.session_state.pending_quick_add:
-            p_data = st.session_state.pending_quick_add
+            # 1. DISPLAY CONFIRMATION BOX (If pending)
+            if st.session_state.pending_quick_add:
+                p_data = st.session_state.pending_quick_add
             
-            with st.container():
-                st.info(f"❓ Confirm Transaction: **{p_data['desc']}** for **${p_data['amount']}**?")
+                with st.container():
+                    st.info(f"❓ Confirm Transaction: **{p_data['desc']}** for **${p_data['amount']}**?")
                 
-                col_confirm, col_cancel = st.columns(2)
-                with col_confirm:
-                    if st.button("✅ YES, ADD IT", use_container_width=True):
-                        # Commit Transaction
-                        save_transaction(
-                            p_data['date'], p_data['owner'], p_data['from'], 
-                            p_data['to'], p_data['cat'], p_data['desc'], p_data['amount']
-                        )
-                        st.session_state.pending_quick_add = None # Clear after save (save_transaction reruns anyway)
+                    col_confirm, col_cancel = st.columns(2)
+                    with col_confirm:
+                        if st.button("✅ YES, ADD IT", use_container_width=True):
+                            # Clear first: save_transaction reruns the script and never returns on success
+                            st.session_state.pending_quick_add = None
+                            if p_data.get('label'):
+                                shortcuts.get_usage().record(current_user, p_data['label'], datetime.now(CALGARY_TZ))
+                            save_transaction(
+                                p_data['date'], p_data['owner'], p_data['from'], 
+                                p_data['to'], p_data['cat'], p_data['desc'], p_data['amount']
+                            )
                 
-                with col_cancel:
-                    if st.button("❌ CANCEL", use_container_width=True):
-                        st.session_state.pending_quick_add = None
-                        st.rerun()
+                    with col_cancel:
+                        if st.button("❌ CANCEL", use_container_width=True):
+                            st.session_state.pending_quick_add = None
+                            st.rerun()
             
-            st.divider() # Visual separation
+                st.divider() # Visual separation
         
-        # 2. DISPLAY BUTTONS (Only if not pending, or show below)
-        # We show them below so user can see what they clicked, but maybe disabled? 
-        # Standard Streamlit flow: just show them.
+            # 2. DISPLAY BUTTONS (Only if not pending, or show below)
+            # We show them below so user can see what they clicked, but maybe disabled? 
+            # Standard Streamlit flow: just show them.
         
-        if not freq_df.empty:
-            if 'Owner' not in freq_df.columns: freq_df['Owner'] = 'Joint'
-            freq_df['Owner'] = freq_df['Owner'].fillna('Joint').replace('', 'Joint')
-
-            owners = ["Jimmy", "Lily", "Joint"]
-            owner_tabs = st.tabs(owners)
-
-            for i, owner_name in enumerate(owners):
-                with owner_tabs[i]:
-                    owner_df = freq_df[freq_df['Owner'] == owner_name]
-                    if owner_df.empty:
-                        st.caption(f"No shortcuts for {owner_name}.")
-                    else:
-                        type_tabs = st.tabs(["💸 Spending", "💰 Income", "⇄ Transfer"])
-                        
-                        def display_buttons(df_subset):
-                            if df_subset.empty:
-                                st.caption("No buttons.")
-                                return
-                            f_cols = st.columns(2)
-                            for idx, (_, row) in enumerate(df_subset.iterrows()):
-                                label = row.get('Label', 'Txn')
-                                amt_val = row.get('Amount', 0.0)
-                                b_key = f"{owner_name}_{idx}_{label}"
-                                
-                                # BUTTON ACTION: STAGE FOR CONFIRMATION
-                                if f_cols[idx % 2].button(f"{label} (${amt_val})", key=b_key, use_container_width=True):
-                                    d_owner = row.get('Owner', current_user)
-                                    d_from = row.get('From', 'External Source')
-                                    d_to = row.get('To', 'External Merchant')
-                                    d_cat = row.get('Category', 'Other')
-                                    d_desc = row.get('Description', label)
-                                    
-                                    # Store in Session State instead of Saving
-                                    st.session_state.pending_quick_add = {
-                                        "date": get_current_date(),
-                                        "owner": d_owner,
-                                        "from": d_from,
-                                        "to": d_to,
-                                        "cat": d_cat,
-                                        "desc": d_desc,
-                                        "amount": amt_val
-                                    }
-                                    st.rerun()
+            if shortcut_index.labels():
+                # Most used first, for whoever is logged in and the time of day
+                usage_scores = shortcuts.get_usage().scores(current_user, datetime.now(CALGARY_TZ))
+                owner_tabs = st.tabs(list(shortcuts.OWNERS))
+
+                def display_buttons(owner_name, kind):
+                    group = shortcut_index.ranked(owner_name, kind, usage_scores)
+                    if not group:
+                        st.caption("No buttons.")
+                        return
+                    f_cols = st.columns(2)
+                    for idx, row in enumerate(group):
+                        label = row['Label'] or 'Txn'
+                        amt_val = row.get('Amount') or 0.0
+                        # Keyed by sheet row so a button keeps its state when the order changes
+                        b_key = f"quick_{row['_row']}"
+
+                        # BUTTON ACTION: STAGE FOR CONFIRMATION
+                        if f_cols[idx % 2].button(f"{label} (${amt_val})", key=b_key, use_container_width=True):
+                            # Store in Session State instead of Saving
+                            st.session_state.pending_quick_add = {
+                                "date": get_current_date(),
+                                "owner": row['Owner'],
+                                "from": row.get('From') or 'External Source',
+                                "to": row.get('To') or 'External Merchant',
+                                "cat": row.get('Category') or 'Other',
+                                "desc": row.get('Description') or label,
+                                "amount": amt_val,
+                                "label": row['Label'],
+                            }
+                            st.rerun()
 
-                        with type_tabs[0]:
-                            spending_df = owner_df[~owner_df['Category'].isin(["Income", "Transfer"])]
-                            display_buttons(spending_df)
-                        with type_tabs[1]:
-                            income_df = owner_df[owner_df['Category'] == "Income"]
-                            display_buttons(income_df)
-                        with type_tabs[2]:
-                            transfer_df = owner_df[owner_df['Category'] == "Transfer"]
-                            display_buttons(transfer_df)
+                for owner_tab, owner_name in zip(owner_tabs, shortcuts.OWNERS):
+                    with owner_tab:
+                        if not shortcut_index.has_owner(owner_name):
+                            st.caption(f"No shortcuts for {owner_name}.")
+                        else:
+                            type_tabs = st.tabs(["💸 Spending", "💰 Income", "⇄ Transfer"])
+                            for type_tab, kind in zip(type_tabs, shortcuts.KINDS):
+                                with type_tab:
+                                    display_buttons(owner_name, kind)
 
-        else:
-            st.info("No frequent transactions found in sheet.")
-
-        # --- EDIT SHORTCUTS SECTION ---
-        st.divider()
-        with st.expander("⚙️ Edit or Delete Shortcuts", expanded=False):
-            if not freq_df.empty:
-                shortcut_labels = freq_df['Label'].tolist()
-                selected_shortcut_label = st.selectbox("Select Shortcut to Edit", shortcut_labels)
+            else:
+                st.info("No frequent transactions found in sheet.")
+
+            # --- EDIT SHORTCUTS SECTION ---
+            st.divider()
+            with st.expander("⚙️ Edit or Delete Shortcuts", expanded=False):
+                if shortcut_index.labels():
+                    selected_shortcut_label = st.selectbox("Select Shortcut to Edit", shortcut_index.labels())
                 
-                if selected_shortcut_label:
-                    shortcut_idx = freq_df[freq_df['Label'] == selected_shortcut_label].index[0]
-                    current_shortcut = freq_df.iloc[shortcut_idx]
-                    sheet_row_num = shortcut_idx + 2 
+                    if selected_shortcut_label:
+                        current_shortcut = shortcut_index.get(selected_shortcut_label)
+                        sheet_row_num = current_shortcut['_row']
 
-                    with st.form("edit_shortcut_form"):
-                        st.caption(f"Editing: {selected_shortcut_label}")
+                        with st.form("edit_shortcut_form"):
+                            st.caption(f"Editing: {selected_shortcut_label}")
                         
-                        ec1, ec2 = st.columns(2)
-                        with ec1:
-                            new_label = st.text_input("Button Label", current_shortcut['Label'])
-                            new_amt = st.number_input("Default Amount", value=float(current_shortcut['Amount']), step=0.01)
-                            new_owner = st.selectbox("Default Owner", owner_options, index=get_index(owner_options, current_shortcut['Owner']))
+                            ec1, ec2 = st.columns(2)
+                            with ec1:
+                                new_label = st.text_input("Button Label", current_shortcut['Label'])
+                                new_amt = st.number_input("Default Amount", value=float(current_shortcut['Amount'] or 0), step=0.01)
+                                new_owner = st.selectbox("Default Owner", owner_options, index=get_index(owner_options, current_shortcut['Owner']))
                         
-                        with ec2:
-                            curr_from_full = find_full_name(current_shortcut['From'], from_options)
-                            curr_to_full = find_full_name(current_shortcut['To'], to_options)
+                            with ec2:
+                                curr_from_full = find_full_name(current_shortcut['From'], from_options)
+                                curr_to_full = find_full_name(current_shortcut['To'], to_options)
                             
-                            new_from = st.selectbox("Default From", from_options, index=get_index(from_options, curr_from_full))
-                            new_to = st.selectbox("Default To", to_options, index=get_index(to_options, curr_to_full))
-                            new_cat = st.selectbox("Default Category", cat_options, index=get_index(cat_options, current_shortcut['Category']))
+                                new_from = st.selectbox("Default From", from_options, index=get_index(from_options, curr_from_full))
+                                new_to = st.selectbox("Default To", to_options, index=get_index(to_options, curr_to_full))
+                                new_cat = st.selectbox("Default Category", cat_options, index=get_index(cat_options, current_shortcut['Category']))
                         
-                        new_desc = st.text_input("Default Description", current_shortcut['Description'])
+                            new_desc = st.text_input("Default Description", current_shortcut['Description'])
                         
-                        col_save, col_del = st.columns([1,1])
-                        with col_save:
-                            submitted = st.form_submit_button("💾 Save Changes", type="primary")
-                        with col_del:
-                            delete_check = st.checkbox("🗑️ Delete this shortcut?")
-
-                        if submitted:
-                            if delete_check:
-                                freq_ws.delete_rows(sheet_row_num)
-                                st.success(f"Deleted {selected_shortcut_label}!")
-                                time.sleep(1)
-                                st.rerun()
-                            else:
-                                if new_from == "External Source": s_from = "External Source"
-                                else: s_from = new_from
+                            col_save, col_del = st.columns([1,1])
+                            with col_save:
+                                submitted = st.form_submit_button("💾 Save Changes", type="primary")
+                            with col_del:
+                                delete_check = st.checkbox("🗑️ Delete this shortcut?")
+
+                            if submitted:
+                                # The row as the mirror has it, so a retried or late write can't hit
+                                # whichever shortcut has moved into that row since
+                                target = {"row": sheet_row_num, "width": len(mirror_db.columns("Frequent Transactions")),
+                                          "version": mirror_db.row_version("Frequent Transactions", sheet_row_num)}
+                                if delete_check:
+                                    queue_write("Frequent Transactions", "delete", f"Delete shortcut {selected_shortcut_label}", **target)
+                                    store.delete_row("Frequent Transactions", sheet_row_num)
+                                    flash(f"Deleted {selected_shortcut_label}!")
+                                    st.rerun()
+                                else:
+                                    if new_from == "External Source": s_from = "External Source"
+                                    else: s_from = new_from
                                 
-                                if new_to == "External Merchant": s_to = "External Merchant"
-                                else: s_to = new_to
+                                    if new_to == "External Merchant": s_to = "External Merchant"
+                                    else: s_to = new_to
+
+                                    row_values = [new_label, new_amt, s_from, s_to, new_cat, new_desc, new_owner]
+                                    queue_write("Frequent Transactions", "update", f"Edit shortcut {new_label}", values=row_values, **target)
+                                    store.update_row("Frequent Transactions", sheet_row_num, row_values)
+                                    shortcuts.get_usage().rename(selected_shortcut_label, new_label)
+                                    flash("Shortcut Updated!")
+                                    st.rerun()
+                else:
+                     st.info("No shortcuts to edit.")
 
-                                row_values = [new_label, new_amt, s_from, s_to, new_cat, new_desc, new_owner]
-                                freq_ws.update(range_name=f"A{sheet_row_num}:G{sheet_row_num}", values=[row_values])
-                                st.success("Shortcut Updated!")
-                                time.sleep(1)
-                                st.rerun()
+    # --- TAB 3: MONTHLY PERFORMANCE ---
+    if tab3.open:
+        with tab3:
+            st.header("Monthly Performance")
+            connected(load_archives)
+            month_options = rollup.available_months(mirror_db)
+            if month_options:
+                today = get_current_date()
+                if (today.year, today.month) not in month_options:
+                    month_options.insert(0, (today.year, today.month))
+                pc1, pc2 = st.columns(2)
+                with pc1:
+                    perf_year, perf_month = st.selectbox(
+                        "Month", month_options, key="perf_month",
+                        format_func=lambda ym: date(ym[0], ym[1], 1).strftime('%B %Y')
+                    )
+                with pc2:
+                    perf_owner = st.selectbox("Whose", ["Everyone"] + owner_options, key="perf_owner")
+                owner_filter = None if perf_owner == "Everyone" else perf_owner
+
+                total_gain, total_spend, net_gain = rollup.month_totals(mirror_db, perf_year, perf_month, owner_filter)
+
+                m1, m2, m3 = st.columns(3)
+                with m1: st.metric("Total Gain", f"${total_gain:,.2f}")
+                with m2: st.metric("Total Spend", f"${total_spend:,.2f}")
+                with m3: st.metric("Net Gain", f"${net_gain:,.2f}")
+                st.caption(f"Showing data for {date(perf_year, perf_month, 1).strftime('%B %Y')}")
+
+                trend_months = st.radio("Trend", [12, 24], horizontal=True, key="perf_trend", format_func=lambda n: f"{n} months")
+                trend_df = rollup.monthly_trend(mirror_db, perf_year, perf_month, trend_months, owner_filter)
+                st.bar_chart(trend_df[["Gain", "Spend"]], stack=False)
+                st.line_chart(trend_df["Net"])
+                st.divider()
+
+            st.subheader("Account Balances")
+            balances_df = balances.balances(mirror_db)
+            if not balances_df.empty:
+                # Ledger Balance is the opening balance plus every transaction; Drift is how far the
+                # sheet's Current Amount is from it
+                if "Drift" in balances_df.columns:
+                    balances_df.insert(0, "⚠️", balances_df["Drift"].abs().ge(0.01).map({True: "⚠️", False: ""}))
+                st.dataframe(balances_df.drop(columns=["_row"]), use_container_width=True, hide_index=True)
+                unassigned_df = balances.unassigned(mirror_db)
+                if not unassigned_df.empty:
+                    st.caption("❓ Not in any balance (no single account matches): " + ", ".join(
+                        f"{r.Owner} - {r.Account} ${r.Amount:,.2f}" for r in unassigned_df.itertuples(index=False)
+                    ))
+
+                drifted = int(balances_df["Drift"].abs().ge(0.01).sum()) if "Drift" in balances_df.columns else 0
+                if drifted:
+                    st.caption(f"⚠️ {drifted} accounts don't match the ledger. If the sheet amounts are right, "
+                               "set the opening balances from them.")
+                    if st.button("📌 Set Opening Balances From Sheet", use_container_width=True):
+                        openings = balances.opening_balances(mirror_db)
+                        queue_write("Accounts", "batch", f"Set opening balances for {len(openings)} accounts",
+                                    data=balances.opening_ranges(mirror_db, openings))
+                        mirror_db.fill_column("Accounts", balances.OPENING_COLUMN, openings)
+                        flash("Opening balances set from the sheet")
+                        st.rerun()
+
+                today = get_current_date()
+                history_df = balances.balance_history(mirror_db, today.year, today.month, 24)
+                bal_accounts = st.multiselect("Balance over time", history_df.columns.tolist(),
+                                              default=history_df.columns.tolist(), key="bal_accounts")
+                if bal_accounts:
+                    st.line_chart(history_df[bal_accounts])
             else:
-                 st.info("No shortcuts to edit.")
+                st.info("No account data found.")
 
-    # --- TAB 3: MONTHLY PERFORMANCE ---
-    with tab3:
-        st.header("Monthly Performance")
-        if not trans_df.empty:
-            trans_df['DateObj'] = pd.to_datetime(trans_df['Date'], errors='coerce')
-            trans_df['Amount'] = pd.to_numeric(trans_df['Amount'], errors='coerce').fillna(0)
-            today = get_current_date()
-            current_month_df = trans_df[
-                (trans_df['DateObj'].dt.month == today.month) & 
-                (trans_df['DateObj'].dt.year == today.year)
-            ]
-            total_gain = current_month_df[current_month_df['Category'] == "Income"]['Amount'].sum()
-            spend_df = current_month_df[(~current_month_df['Category'].isin(["Income", "Transfer"]))]
-            total_spend = spend_df['Amount'].sum()
-            net_gain = total_gain - total_spend
-
-            m1, m2, m3 = st.columns(3)
-            with m1: st.metric("Total Gain", f"${total_gain:,.2f}")
-            with m2: st.metric("Total Spend", f"${total_spend:,.2f}")
-            with m3: st.metric("Net Gain", f"${net_gain:,.2f}")
-            st.caption(f"Showing data for {today.strftime('%B %Y')}")
             st.divider()
-
-        st.subheader("Account Balances")
-        if not accounts_df.empty:
-            display_cols = ["Owner", "Account", "Current Amount", "Next Payment"]
-            existing_cols = [c for c in display_cols if c in accounts_df.columns]
-            st.dataframe(accounts_df[existing_cols], use_container_width=True, hide_index=True)
-        else:
-            st.info("No account data found.")
+            st.subheader("📈 Multi-year Analytics")
+            analytics_years = sorted({y for y, _ in month_options})
+            if analytics_years:
+                # Rewritten in the background after syncs and writes, from the first time this tab opens
+                snaps = get_snapshots()
+                snaps.start()
+                snaps.request()
+                if not snaps.files():
+                    snaps.refresh()  # very first run: write them now rather than wait for the worker
+                ac1, ac2 = st.columns(2)
+                with ac1:
+                    if len(analytics_years) > 1:
+                        first_year, last_year = st.select_slider("Years", analytics_years, key="an_years",
+                                                                  value=(analytics_years[0], analytics_years[-1]))
+                    else:
+                        first_year = last_year = analytics_years[0]
+                with ac2:
+                    an_owner = st.selectbox("Whose", ["Everyone"] + owner_options, key="an_owner")
+                an_df = analytics.monthly(snaps, first_year, last_year)
+                if an_owner != "Everyone":
+                    owner_df = an_df[an_df["owner"] == an_owner]
+                else:
+                    owner_df = an_df
+                st.caption("Spend per category per month")
+                st.bar_chart(analytics.category_by_month(owner_df))
+                st.caption("Spend by month, year over year")
+                st.line_chart(analytics.year_over_year(owner_df))
+                st.caption(f"Income and spend per owner, {first_year}–{last_year}")
+                st.bar_chart(analytics.owner_breakdown(an_df), stack=False)
 
     # --- TAB 4: HISTORY ---
-    with tab4:
-        st.header("Transaction History")
-        if not trans_df.empty:
-            trans_df['GS_Row_Num'] = trans_df.index + 2
-            trans_df['Label'] = (
-                "Row " + trans_df['GS_Row_Num'].astype(str) + ": " + 
-                trans_df['Date'].astype(str) + " | " + 
-                trans_df['Description'].astype(str) + " | $" + 
-                trans_df['Amount'].astype(str)
-            )
-            selection_options = trans_df['Label'].tolist()[::-1]
-
-            with st.expander("🗑️ Delete a Transaction", expanded=False):
-                delete_selection = st.selectbox("Select Transaction to Delete", selection_options, key="del_select")
-                if st.button("Confirm Delete 🗑️", type="primary"):
+    if tab4.open:
+        with tab4:
+            st.header("Transaction History")
+            connected(load_archives)
+            rules_ws, rules_df, categorizer = connected(load_rules)
+            if mirror_db.row_count("Transaction"):
+                with st.expander("🔎 Filters", expanded=False):
+                    date_range = st.date_input("Date Range", value=(), key="hist_dates")
+                    fc1, fc2, fc3 = st.columns(3)
+                    with fc1: hist_owner = st.selectbox("Owner", ["All"] + owner_options, key="hist_owner")
+                    with fc2: hist_account = st.selectbox("Account", ["All"] + account_options, key="hist_account")
+                    with fc3: hist_cat = st.selectbox("Category", ["All"] + cat_options, key="hist_cat")
+
+                hist_filters = {
+                    "start": date_range[0] if len(date_range) > 0 else None,
+                    "end": date_range[1] if len(date_range) > 1 else None,
+                    "owner": None if hist_owner == "All" else hist_owner,
+                    "account": None if hist_account == "All" else parse_account_string(hist_account, ""),
+                    "category": None if hist_cat == "All" else hist_cat,
+                }
+                if st.session_state.get("hist_filters") != hist_filters:
+                    st.session_state.hist_filters = hist_filters
+                    st.session_state.hist_page = 0
+
+                match_count = history.count(mirror_db, **hist_filters)
+                page_count = max((match_count - 1) // history.PAGE_SIZE + 1, 1)
+                page_num = min(st.session_state.get("hist_page", 0), page_count - 1)
+                page_df = history.page(mirror_db, page_num, **hist_filters)
+                page_txns = page_df.set_index('Key', drop=False)
+                selection_options = page_df['Key'].tolist()
+                label_of = page_txns['Label'].get
+
+                with st.expander("🗑️ Delete a Transaction", expanded=False):
+                    delete_selection = st.selectbox("Select Transaction to Delete", selection_options, format_func=label_of, key="del_select")
                     if delete_selection:
-                        row_num_del = int(delete_selection.split(":")[0].replace("Row ", ""))
-                        try:
-                            trans_ws.delete_rows(row_num_del)
-                            st.success(f"Deleted row {row_num_del}!")
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"Error: {e}")
-
-            with st.expander("✏️ Edit a Transaction", expanded=False):
-                edit_selection = st.selectbox("Select Transaction to Edit", selection_options, key="edit_select")
-                if edit_selection:
-                    row_num = int(edit_selection.split(":")[0].replace("Row ", ""))
-                    df_index = row_num - 2
-                    current_data = trans_df.loc[df_index]
-                    try: current_date = pd.to_datetime(current_data['Date']).date()
-                    except: current_date = get_current_date()
-
-                    with st.form("edit_form"):
-                        st.caption(f"Editing Row {row_num}")
-                        ecol1, ecol2 = st.columns(2)
-                        with ecol1:
-                            new_date = st.date_input("Date", current_date)
-                            new_owner = st.selectbox("Owner", owner_options, index=get_index(owner_options, current_data['Owner']))
-                            new_amount = st.number_input("Amount ($)", value=float(current_data['Amount']), step=0.01, format="%.2f")
-                        with ecol2:
-                            curr_from_full = find_full_name(current_data['From'], from_options)
-                            curr_to_full = find_full_name(current_data['To'], to_options)
-                            new_from = st.selectbox("From", from_options, index=get_index(from_options, curr_from_full))
-                            new_to = st.selectbox("To", to_options, index=get_index(to_options, curr_to_full))
-                            new_cat = st.selectbox("Category", cat_options, index=get_index(cat_options, current_data['Category']))
-                        new_desc = st.text_input("Description", value=current_data['Description'])
-                        update_submitted = st.form_submit_button("💾 Update Transaction", type="primary")
+                        del_txn = page_txns.loc[delete_selection]
+                        del_seen = seen_version("delete", del_txn)
+                    if st.button("Confirm Delete 🗑️", type="primary"):
+                        if delete_selection:
+                            target = del_seen and ledger.cas_target(mirror_db, del_txn.get('ID'), del_seen, del_txn['_row'], del_txn['_sheet'])
+                            if not target:
+                                cas_failed("delete")
+                            else:
+                                queue_write(del_txn['_sheet'], "delete", f"Delete {label_of(delete_selection)}", **target)
+                                store.delete_row(del_txn['_sheet'], target['row'])
+                                st.session_state.seen_versions.pop("delete", None)
+                                flash(f"Deleted {label_of(delete_selection)}!")
+                                st.rerun()
+
+                with st.expander("✏️ Edit a Transaction", expanded=False):
+                    edit_selection = st.selectbox("Select Transaction to Edit", selection_options, format_func=label_of, key="edit_select")
+                    if edit_selection:
+                        current_data = page_txns.loc[edit_selection]
+                        row_num = current_data['_row']
+                        edit_seen = seen_version("edit", current_data)
+                        current_date = current_data['Date'].date() if pd.notna(current_data['Date']) else get_current_date()
+
+                        with st.form("edit_form"):
+                            st.caption(f"Editing Row {row_num}")
+                            ecol1, ecol2 = st.columns(2)
+                            with ecol1:
+                                new_date = st.date_input("Date", current_date)
+                                new_owner = st.selectbox("Owner", owner_options, index=get_index(owner_options, current_data['Owner']))
+                                new_amount = st.number_input("Amount ($)", value=schema.dollars(current_data['Cents']), step=0.01, format="%.2f")
+                            with ecol2:
+                                curr_from_full = find_full_name(current_data['From'], from_options)
+                                curr_to_full = find_full_name(current_data['To'], to_options)
+                                new_from = st.selectbox("From", from_options, index=get_index(from_options, curr_from_full))
+                                new_to = st.selectbox("To", to_options, index=get_index(to_options, curr_to_full))
+                                new_cat = st.selectbox("Category", cat_options, index=get_index(cat_options, current_data['Category']))
+                            new_desc = st.text_input("Description", value=current_data['Description'])
+                            update_submitted = st.form_submit_button("💾 Update Transaction", type="primary")
                         
-                        if update_submitted:
-                            range_name = f"A{row_num}:G{row_num}"
-                            updated_values = [[str(new_date), new_owner, new_from, new_to, new_cat, new_desc, new_amount]]
-                            trans_ws.update(range_name=range_name, values=updated_values)
-                            st.success("Updated!")
-                            st.rerun()
+                            if update_submitted:
+                                target = edit_seen and ledger.cas_target(mirror_db, current_data.get('ID'), edit_seen, row_num, current_data['_sheet'])
+                                if not target:
+                                    cas_failed("edit")
+                                else:
+                                    updated_values = [str(new_date), new_owner, new_from, new_to, new_cat, new_desc, schema.cents_of(new_amount) / 100]
+                                    queue_write(current_data['_sheet'], "update", f"Edit: {new_desc}", values=updated_values, **target)
+                                    store.update_row(current_data['_sheet'], target['row'], updated_values)
+                                    st.session_state.seen_versions.pop("edit", None)
+                                    flash("Updated!")
+                                    st.rerun()
 
-            st.markdown("### Recent Activity")
-            display_df = trans_df.drop(columns=['GS_Row_Num', 'Label', 'DateObj'], errors='ignore')
-            st.dataframe(display_df.tail(15).iloc[::-1], use_container_width=True, hide_index=True)
-        else:
-            st.info("No transaction history found.")
+                with st.expander("🏷️ Category Rules", expanded=False):
+                    if rules_ws is None:
+                        st.caption(f"Add a \"{categorize.RULES_SHEET}\" sheet with Pattern and Category columns to categorize by description.")
+                    else:
+                        st.caption("Notes containing a pattern get its category; the first matching rule wins. Start a pattern with re: for a regular expression.")
+                        if not rules_df.empty:
+                            st.dataframe(rules_df, use_container_width=True, hide_index=True, height=180)
+                        with st.form("add_rule_form", clear_on_submit=True):
+                            rc1, rc2 = st.columns(2)
+                            with rc1: rule_pattern = st.text_input("Pattern", placeholder="e.g. tim hortons")
+                            with rc2: rule_cat = st.selectbox("Category", cat_options, index=get_index(cat_options, "Food/Groceries"))
+                            if st.form_submit_button("➕ Add Rule") and rule_pattern.strip():
+                                rule_row = [rule_pattern.strip(), rule_cat]
+                                queue_write(categorize.RULES_SHEET, "append", f"Rule: {rule_row[0]} → {rule_cat}",
+                                            rows=[rule_row], start_row=mirror_db.row_count(categorize.RULES_SHEET) + 2)
+                                store.append_rows(categorize.RULES_SHEET, [rule_row])
+                                flash(f"Added rule {rule_row[0]} → {rule_cat}")
+                                st.rerun()
+
+                        # Scanning the whole ledger waits for a click instead of running on every rerun
+                        if len(categorizer) and st.button("🔍 Check History Against Rules", use_container_width=True):
+                            connected(load_archives)
+                            recat = categorize.recategorize_all(categorizer, mirror_db)
+                            st.session_state.recat_count = sum(len(changes) for changes in recat.values())
+                        recat_count = st.session_state.get("recat_count")
+                        if recat_count == 0:
+                            st.caption("History already matches the rules.")
+                        elif recat_count:
+                            st.caption(f"{recat_count} past transactions would get a different category under these rules.")
+                            if st.button(f"🏷️ Re-categorize {recat_count} Transactions", type="primary", use_container_width=True):
+                                connected(load_archives)
+                                recat = categorize.recategorize_all(categorizer, mirror_db)
+                                for sheet, changes in recat.items():
+                                    # Only the Category cells, one range per run of rows, in one request per sheet
+                                    queue_write(sheet, "batch", f"Re-categorize {len(changes)} transactions in {sheet}",
+                                                data=categorize.category_ranges(mirror_db, changes, sheet))
+                                    mirror_db.fill_column(sheet, "Category", changes)
+                                st.session_state.pop("recat_count", None)
+                                flash(f"Re-categorized {sum(len(changes) for changes in recat.values())} transactions")
+                                st.rerun()
+
+                st.markdown("### Recent Activity")
+                page_view = page_df.assign(Cents=schema.dollars(page_df['Cents'])).rename(columns={'Cents': 'Amount'})
+                st.dataframe(page_view.drop(columns=['_row', '_hash', '_sheet', 'Key', 'Label', 'ID'], errors='ignore'), use_container_width=True, hide_index=True)
+                pg1, pg2, pg3 = st.columns([1, 2, 1])
+                with pg1:
+                    if st.button("◀", key="hist_prev", disabled=page_num == 0, use_container_width=True):
+                        st.session_state.hist_page = page_num - 1
+                        st.rerun()
+                with pg2: st.caption(f"Page {page_num + 1} of {page_count} · {match_count} transactions")
+                with pg3:
+                    if st.button("▶", key="hist_next", disabled=page_num >= page_count - 1, use_container_width=True):
+                        st.session_state.hist_page = page_num + 1
+                        st.rerun()
+            else:
+                st.info("No transaction history found.")
+
+    # --- DEBUG TIMINGS (opt-in) ---
+    if st.sidebar.toggle("🐞 Debug timings", key="debug_timings"):
+        trace_run = tracing.current_run()
+        with st.sidebar.expander("⏱️ This run", expanded=True):
+            summary = tracing.run_summary(trace_run)
+            st.caption(f"{summary['elapsed_ms']:,.0f} ms so far · {summary['sheets_calls']} Sheets calls "
+                       f"({summary['sheets_ms']:,.0f} ms) · {summary['spans']} steps")
+            if trace_run["spans"]:
+                st.dataframe(pd.DataFrame(trace_run["spans"]), use_container_width=True, hide_index=True)
+            background = tracing.background_spans()
+            if background:
+                st.caption("Background writes (latest last)")
+                st.dataframe(pd.DataFrame(background[-10:]), use_container_width=True, hide_index=True)
+            st.download_button("Metrics (Prometheus text)", tracing.prometheus_text(), "finance_metrics.prom", "text/plain")
+            if tracing.TRACE_ENABLED:
+                st.caption(f"Traces: {tracing.TRACE_PATH}")
+
+tracing.finish_run(user=st.session_state.get("current_user", ""))
@@ -0,0 +1,183 @@
+import pandas as pd
+
+import tracing
+from ledger import column_letter
+from rollup import parse_amounts, parse_dates
+
+OWNERS = ("Jimmy", "Lily", "Joint")
+EXTERNAL_ACCOUNTS = ("External Source", "External Merchant", "")
+OPENING_COLUMN = "Opening Balance"
+# Accounts sheet columns shown as they are, after the balances
+DISPLAY_COLUMNS = ("Next Payment",)
+# Accounts where spending raises the amount owed; their balance is shown as the debt
+LIABILITY_PATTERN = r"(?i)credit|card|loan|mortgage|line of credit"
+
+
+# Each ledger row moves money out of From and into To. Rows store the bare account name with
+# the row's Owner, but edits may have saved the full "Owner - Account" name; both resolve to
+# the same (owner, account) key here. Returns one row per leg with a signed amount in cents.
+def ledger_legs(df):
+    if not {"Owner", "From", "To", "Amount"} <= set(df.columns):
+        return pd.DataFrame(columns=["owner", "account", "year", "month", "cents"])
+    dates = parse_dates(df["Date"]) if "Date" in df.columns else pd.Series(pd.NaT, index=df.index)
+    cents = (parse_amounts(df["Amount"]) * 100).round().astype("int64")
+    legs = []
+    for side, sign in (("From", -1), ("To", 1)):
+        name = df[side].fillna("").astype(str).str.strip()
+        split = name.str.extract(r"^(" + "|".join(OWNERS) + r") - (.+)$")
+        legs.append(pd.DataFrame({
+            "owner": split[0].fillna(df["Owner"].fillna("").astype(str)),
+            "account": split[1].fillna(name),
+            # Undated rows still count towards the balance; they sort before everything else
+            "year": dates.dt.year.fillna(0).astype("int64"),
+            "month": dates.dt.month.fillna(0).astype("int64"),
+            "cents": sign * cents,
+        })[~name.isin(EXTERNAL_ACCOUNTS)])
+    return pd.concat(legs, ignore_index=True)
+
+
+# --- BALANCE CHECKPOINTS ---
+# Net flow per (owner, account, month) in cents, kept next to the mirrored ledger like the
+# monthly rollup. Every month is a checkpoint: a new or edited row only adds its delta to one
+# or two checkpoints, and a balance at any month is the opening balance plus the running sum
+# of a few hundred checkpoint rows, never a replay of the ledger.
+class BalanceCheckpoints:
+    def attach(self, mirror, sheet):
+        exists = mirror.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'balance_checkpoints'"
+        ).fetchone()
+        mirror.conn.execute(
+            "CREATE TABLE IF NOT EXISTS balance_checkpoints (owner TEXT, account TEXT, year INTEGER, month INTEGER, "
+            "net_cents INTEGER, txn_count INTEGER, PRIMARY KEY (owner, account, year, month))"
+        )
+        if not exists:
+            df = mirror.frame(sheet)
+            if not df.empty:
+                self._apply(mirror.conn, df, 1)
+
+    def change(self, conn, header, removed, added):
+        if removed:
+            self._apply(conn, pd.DataFrame(removed, columns=header), -1)
+        if added:
+            self._apply(conn, pd.DataFrame(added, columns=header), 1)
+
+    def _apply(self, conn, df, sign):
+        legs = ledger_legs(df)
+        if legs.empty:
+            return
+        grouped = legs.groupby(["owner", "account", "year", "month"], as_index=False).agg(
+            net=("cents", "sum"), n=("cents", "size")
+        )
+        conn.executemany(
+            "INSERT INTO balance_checkpoints VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (owner, account, year, month) DO UPDATE SET "
+            "net_cents = net_cents + excluded.net_cents, txn_count = txn_count + excluded.txn_count",
+            [
+                (r.owner, r.account, int(r.year), int(r.month), sign * int(r.net), sign * int(r.n))
+                for r in grouped.itertuples(index=False)
+            ],
+        )
+        conn.execute("DELETE FROM balance_checkpoints WHERE txn_count <= 0")
+
+
+# --- QUERIES ---
+# Accounts sheet rows with their ledger key and sign. Ledger keys that match no account (a
+# row saved under another owner) are folded into the account of that name when it is unique.
+def _accounts(mirror):
+    header = mirror.columns("Accounts")
+    if not mirror.row_count("Accounts") or not {"Owner", "Account"} <= set(header):
+        return pd.DataFrame()
+    acc = mirror.query("SELECT * FROM {Accounts} ORDER BY _row")
+    acc["Name"] = acc["Owner"].astype(str) + " - " + acc["Account"].astype(str)
+    acc["liability"] = acc["Account"].astype(str).str.contains(LIABILITY_PATTERN, regex=True)
+    acc["opening"] = parse_amounts(acc[OPENING_COLUMN]) if OPENING_COLUMN in acc.columns else 0.0
+    return acc
+
+
+def _checkpoints(mirror, acc):
+    cp = mirror.query("SELECT owner, account, year, month, net_cents FROM balance_checkpoints")
+    names = cp["owner"] + " - " + cp["account"]
+    unique_names = acc.drop_duplicates("Account", keep=False).set_index("Account")["Name"]
+    # Keys that resolve to no account keep a missing Name (see unassigned)
+    cp["Name"] = names.where(names.isin(acc["Name"]), cp["account"].map(unique_names))
+    return cp
+
+
+@tracing.traced("balances.balances")
+def balances(mirror):
+    acc = _accounts(mirror)
+    if acc.empty:
+        return acc
+    cp = _checkpoints(mirror, acc)
+    flow = cp.groupby("Name")["net_cents"].sum().reindex(acc["Name"]).fillna(0).to_numpy() / 100
+    sign = acc["liability"].map({True: -1, False: 1}).to_numpy()
+    out = pd.DataFrame({"Owner": acc["Owner"], "Account": acc["Account"]})
+    if "Current Amount" in acc.columns:
+        out["Current Amount"] = parse_amounts(acc["Current Amount"])
+    out["Ledger Balance"] = (acc["opening"].to_numpy() + sign * flow).round(2)
+    if "Current Amount" in out.columns:
+        out["Drift"] = (out["Current Amount"] - out["Ledger Balance"]).round(2)
+    for col in DISPLAY_COLUMNS:
+        if col in acc.columns:
+            out[col] = acc[col]
+    out["_row"] = acc["_row"]
+    return out
+
+
+# Net ledger flow on (owner, account) keys that resolve to no Accounts row, e.g. a Joint row
+# on "Credit Card" when Jimmy and Lily both have one. No balance includes it, so it is shown
+# on its own instead of only turning up as drift.
+@tracing.traced("balances.unassigned")
+def unassigned(mirror):
+    acc = _accounts(mirror)
+    if acc.empty:
+        return pd.DataFrame(columns=["Owner", "Account", "Amount"])
+    cp = _checkpoints(mirror, acc)
+    flow = cp[cp["Name"].isna()].groupby(["owner", "account"], as_index=False)["net_cents"].sum()
+    flow = flow[flow["net_cents"] != 0]
+    return pd.DataFrame({"Owner": flow["owner"], "Account": flow["account"], "Amount": flow["net_cents"] / 100})
+
+
+# Month-end balance per account ("Owner - Account" columns) for the last `months` months
+@tracing.traced("balances.balance_history")
+def balance_history(mirror, year, month, months=24):
+    acc = _accounts(mirror)
+    if acc.empty:
+        return pd.DataFrame()
+    cp = _checkpoints(mirror, acc)
+    end = year * 12 + (month - 1)
+    start = end - months + 1
+    cp["m"] = cp["year"] * 12 + cp["month"] - 1
+    # Everything before the window (and undated rows) collapses into its first month
+    cp["m"] = cp["m"].clip(lower=start)
+    flows = cp[cp["m"] <= end].pivot_table(index="m", columns="Name", values="net_cents", aggfunc="sum")
+    flows = flows.reindex(index=range(start, end + 1), columns=acc["Name"]).fillna(0)
+    sign = acc.set_index("Name")["liability"].map({True: -1, False: 1})
+    opening = acc.set_index("Name")["opening"]
+    history = flows.cumsum() / 100 * sign + opening
+    history.index = [f"{m // 12}-{m % 12 + 1:02d}" for m in history.index]
+    history.columns.name = None
+    return history.round(2)
+
+
+# --- RECONCILE ---
+# Opening balances that make the ledger agree with today's "Current Amount", written to an
+# "Opening Balance" column on the Accounts sheet so they outlive the local mirror.
+def opening_balances(mirror):
+    out = balances(mirror)
+    if out.empty or "Drift" not in out.columns:
+        return {}
+    acc = _accounts(mirror)
+    opening = (acc["opening"].to_numpy() + out["Drift"].to_numpy()).round(2)
+    return {int(r): float(v) for r, v in zip(out["_row"], opening)}
+
+
+def opening_ranges(mirror, values_by_row):
+    header = mirror.columns("Accounts")
+    col = header.index(OPENING_COLUMN) + 1 if OPENING_COLUMN in header else len(header) + 1
+    letter = column_letter(col)
+    data = [] if OPENING_COLUMN in header else [{"range": f"{letter}1", "values": [[OPENING_COLUMN]]}]
+    rows = sorted(values_by_row)
+    data.append({"range": f"{letter}{rows[0]}:{letter}{rows[-1]}",
+                 "values": [[values_by_row.get(r, "")] for r in range(rows[0], rows[-1] + 1)]})
+    return data
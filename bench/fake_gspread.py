@@ -0,0 +1,273 @@
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from contextlib import contextmanager
+from unittest import mock
+
+import gspread
+import requests
+
+import partitions
+
+# --- FAKE GOOGLE SHEETS ---
+# An in-process stand-in for the parts of the gspread client the app uses. Cells live in plain
+# lists; every API method counts one call, can sleep to mimic network latency and can fail
+# with a 429 quota error, so the app can be run and measured without credentials.
+
+HEADER = ["Date", "Owner", "From", "To", "Category", "Description", "Amount", "ID"]
+
+
+def _col(letters):
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n
+
+
+# "A1", "B2:D9", "A5:H", "'Sheet'!A1:H1" -> (row1, col1, row2 or None, col2 or None)
+def parse_a1(a1):
+    a1 = a1.split("!")[-1].replace("$", "")
+    m = re.match(r"([A-Z]+)?(\d+)?(?::([A-Z]+)?(\d+)?)?$", a1)
+    c1, r1, c2, r2 = m.groups()
+    return (int(r1) if r1 else 1, _col(c1) if c1 else 1, int(r2) if r2 else None, _col(c2) if c2 else None)
+
+
+def quota_error():
+    response = requests.Response()
+    response.status_code = 429
+    response._content = json.dumps({"error": {
+        "code": 429, "status": "RESOURCE_EXHAUSTED",
+        "message": "Quota exceeded for quota metric 'Read requests' (fake)",
+    }}).encode()
+    return gspread.exceptions.APIError(response)
+
+
+class FakeSpreadsheet:
+    def __init__(self, sheets, latency=0.0, jitter=0.0, quota_error_rate=0.0, seed=0):
+        self.id = "fake-spreadsheet"
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_error_rate = quota_error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = Counter()  # (sheet, method) -> count
+        self.errors = Counter()
+        self.sheets = {name: FakeWorksheet(self, name, rows) for name, rows in sheets.items()}
+
+    # Every API method goes through here: count it, wait, maybe refuse it
+    def _call(self, sheet, method):
+        with self.lock:
+            self.calls[(sheet, method)] += 1
+            fail = self.quota_error_rate and self.random.random() < self.quota_error_rate
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        if fail:
+            with self.lock:
+                self.errors[(sheet, method)] += 1
+            raise quota_error()
+
+    def total_calls(self):
+        with self.lock:
+            return sum(self.calls.values())
+
+    def worksheet(self, name):
+        self._call(name, "worksheet")
+        if name not in self.sheets:
+            raise gspread.exceptions.WorksheetNotFound(name)
+        return self.sheets[name]
+
+    def worksheets(self):
+        self._call("", "worksheets")
+        return list(self.sheets.values())
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        self._call(title, "add_worksheet")
+        self.sheets[title] = FakeWorksheet(self, title, [])
+        return self.sheets[title]
+
+    # ranges like "'Transaction'!A1:H1" or "'Accounts'"; like the API, trailing empty cells
+    # and rows are left out and an empty range has no "values"
+    def values_batch_get(self, ranges, params=None):
+        self._call("", "values_batch_get")
+        render = {"value_render_option": (params or {}).get("valueRenderOption")}
+        value_ranges = []
+        for a1 in ranges:
+            title, _, cells = a1.partition("!")
+            ws = self.sheets[title[1:-1].replace("''", "'")]
+            values = ws._render(ws._range(cells), render)
+            values = [r[:max((i + 1 for i, c in enumerate(r) if c not in ("", None)), default=0)] for r in values]
+            while values and not values[-1]:
+                values.pop()
+            value_ranges.append({"range": a1, "values": values} if values else {"range": a1})
+        return {"valueRanges": value_ranges}
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet, title, rows):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.id = abs(hash(title)) % 100000
+        self.rows = [list(r) for r in rows]
+
+    # UNFORMATTED_VALUE gives numbers back as numbers; anything else renders text
+    def _render(self, rows, kw):
+        if str(kw.get("value_render_option")) in ("UNFORMATTED_VALUE", "ValueRenderOption.unformatted"):
+            return [list(r) for r in rows]
+        return [["" if c is None else str(c) for c in r] for r in rows]
+
+    def _range(self, a1):
+        r1, c1, r2, c2 = parse_a1(a1)
+        r2 = r2 or len(self.rows)
+        c2 = c2 or max((len(r) for r in self.rows), default=0)
+        return [r[c1 - 1:c2] for r in self.rows[r1 - 1:r2]]
+
+    def _write(self, a1, values):
+        r1, c1, _, _ = parse_a1(a1)
+        for i, row in enumerate(values):
+            while len(self.rows) < r1 + i:
+                self.rows.append([])
+            cur = self.rows[r1 + i - 1]
+            cur.extend([""] * (c1 - 1 + len(row) - len(cur)))
+            cur[c1 - 1:c1 - 1 + len(row)] = row
+
+    # --- READS ---
+    def get_all_values(self, **kw):
+        self.spreadsheet._call(self.title, "get_all_values")
+        return self._render(self.rows, kw)
+
+    def get_all_records(self, **kw):
+        self.spreadsheet._call(self.title, "get_all_records")
+        if not self.rows:
+            return []
+        header = self.rows[0]
+        return [dict(zip(header, r + [""] * (len(header) - len(r)))) for r in self.rows[1:]]
+
+    def get(self, range_name=None, **kw):
+        self.spreadsheet._call(self.title, "get")
+        return self._render(self._range(range_name or "A1:ZZ"), kw)
+
+    def batch_get(self, ranges, **kw):
+        self.spreadsheet._call(self.title, "batch_get")
+        return [self._render(self._range(a1), kw) for a1 in ranges]
+
+    def row_values(self, row, **kw):
+        self.spreadsheet._call(self.title, "row_values")
+        return self._render([self.rows[row - 1]], kw)[0] if row <= len(self.rows) else []
+
+    def col_values(self, col, **kw):
+        self.spreadsheet._call(self.title, "col_values")
+        return [str(r[col - 1]) if len(r) >= col else "" for r in self.rows]
+
+    # --- WRITES ---
+    def update(self, range_name=None, values=None, **kw):
+        self.spreadsheet._call(self.title, "update")
+        self._write(range_name, values)
+        return {"updatedRange": f"'{self.title}'!{range_name}", "updatedRows": len(values)}
+
+    def batch_update(self, data, **kw):
+        self.spreadsheet._call(self.title, "batch_update")
+        for d in data:
+            self._write(d["range"], d["values"])
+        return {"totalUpdatedRows": sum(len(d["values"]) for d in data)}
+
+    def append_rows(self, values, **kw):
+        self.spreadsheet._call(self.title, "append_rows")
+        start = len(self.rows) + 1
+        self.rows.extend(list(v) for v in values)
+        width = max(len(v) for v in values)
+        end_col = gspread.utils.rowcol_to_a1(1, width).rstrip("1")
+        return {"updates": {
+            "updatedRange": f"'{self.title}'!A{start}:{end_col}{start + len(values) - 1}",
+            "updatedRows": len(values),
+        }}
+
+    def append_row(self, values, **kw):
+        return self.append_rows([values], **kw)
+
+    def delete_rows(self, start_index, end_index=None):
+        self.spreadsheet._call(self.title, "delete_rows")
+        del self.rows[start_index - 1:(end_index or start_index)]
+        return {}
+
+
+class FakeClient:
+    def __init__(self, spreadsheet):
+        self.spreadsheet = spreadsheet
+
+    def open(self, title, **kw):
+        self.spreadsheet._call("", "open")
+        return self.spreadsheet
+
+    def open_by_key(self, key):
+        self.spreadsheet._call("", "open_by_key")
+        return self.spreadsheet
+
+
+# Routes the app's gspread.authorize() to the fake for the duration of the block
+@contextmanager
+def patched(spreadsheet):
+    with mock.patch("gspread.authorize", lambda creds, **kw: FakeClient(spreadsheet)), \
+         mock.patch("oauth2client.service_account.ServiceAccountCredentials.from_json_keyfile_dict",
+                    lambda keyfile_dict, scopes=None, **kw: object()):
+        yield spreadsheet
+
+
+# --- SYNTHETIC DATA ---
+ACCOUNTS = [
+    ["Owner", "Account", "Current Amount", "Next Payment"],
+    ["Jimmy", "Credit Card", 1200, "2026-11-01"],
+    ["Jimmy", "Chequing", 3400, ""],
+    ["Lily", "Credit Card", 800, "2026-11-05"],
+    ["Lily", "Savings", 9000, ""],
+    ["Joint", "Chequing", 5200, ""],
+]
+FREQUENT = [
+    ["Label", "Amount", "From", "To", "Category", "Description", "Owner"],
+    ["Coffee", 5.25, "Jimmy - Credit Card", "External Merchant", "Food/Groceries", "Coffee", "Jimmy"],
+    ["Groceries", 120, "Joint - Chequing", "External Merchant", "Food/Groceries", "Groceries", "Joint"],
+    ["Daycare", 900, "Joint - Chequing", "External Merchant", "Childcare", "Daycare", "Joint"],
+    ["Pay", 3100, "External Source", "Joint - Chequing", "Income", "Paycheque", "Joint"],
+]
+MERCHANTS = ["Safeway", "Costco", "Tim Hortons", "Shell", "Amazon", "Netflix", "Calgary Co-op", "IKEA", "Daycare", "Rent"]
+CATEGORIES = ["Food/Groceries", "Housing", "Childcare", "Transportation", "Shopping", "Other"]
+
+
+# n ledger rows spread over the last few years, oldest first, the way the app appends them
+def ledger(n, seed=1, end=None):
+    rnd = random.Random(seed)
+    end = end or time.time()
+    span = 4 * 365 * 86400
+    rows = [HEADER]
+    for i in range(n):
+        day = time.strftime("%Y-%m-%d", time.localtime(end - span + span * i / max(n, 1)))
+        kind = rnd.random()
+        owner = rnd.choice(["Jimmy", "Lily", "Joint"])
+        if kind < 0.1:
+            row = [day, "Joint", "External Source", "Chequing", "Income", "Paycheque", round(rnd.uniform(1500, 3500), 2)]
+        elif kind < 0.15:
+            row = [day, owner, "Chequing", "", "Transfer", "Card payment", round(rnd.uniform(100, 900), 2)]
+        else:
+            account = "Credit Card" if owner != "Joint" else "Chequing"
+            row = [day, owner, account, "External Merchant", rnd.choice(CATEGORIES),
+                   f"{rnd.choice(MERCHANTS)} #{rnd.randint(1, 999)}", round(rnd.uniform(2, 250), 2)]
+        rows.append(row + [f"{i:012x}"])
+    return rows
+
+
+# Closed years sit in their archive sheets, as the app leaves them after the first login;
+# partitioned=False puts every year in the Transaction sheet (that login then archives them)
+def spreadsheet(n, partitioned=True, **options):
+    rows = ledger(n)
+    sheets = {"Transaction": rows}
+    if partitioned:
+        open_year = (date.today() - timedelta(days=partitions.ARCHIVE_GRACE_DAYS)).year
+        sheets["Transaction"] = [HEADER] + [r for r in rows[1:] if int(r[0][:4]) >= open_year]
+        for r in rows[1:]:
+            if int(r[0][:4]) < open_year:
+                sheets.setdefault(partitions.archive_name(r[0][:4]), [HEADER]).append(r)
+    return FakeSpreadsheet(dict(sheets, **{"Accounts": ACCOUNTS, "Frequent Transactions": FREQUENT}), **options)
@@ -0,0 +1,251 @@
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# --- OFFLINE BENCHMARKS ---
+# Drives app.py headlessly (Streamlit's AppTest) against the fake spreadsheet in
+# bench/fake_gspread.py and reports, per step: script run time, API calls made during the run,
+# API calls made afterwards by the background outbox, and peak Python memory.
+#
+#   python -m bench.run                          # 1k, 10k and 100k row ledgers
+#   python -m bench.run --rows 5000 --latency 0.08 --quota-error-rate 0.05
+#   python -m bench.run --single-sheet           # every year in one sheet: login archives them
+#
+# Once the outbox has pushed everything, every sheet the mirror holds must match it row for row;
+# the run fails otherwise (a lost, duplicated or misplaced write).
+#
+# Each ledger size runs in its own process with its own scratch mirror, so nothing is shared
+# between sizes. Timing and memory are measured in separate processes (tracemalloc slows
+# the script down). Only the open tab runs; an "open" step is the first run of a tab (the
+# sheets it loads), the other tab steps are runs triggered by a widget in that tab. The PIN
+# screen is measured before anything else is imported, so it is the cold start of a process.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "app.py")
+PIN = "1111"
+TABS = {"tab1": "➕ Add Entry", "tab2": "⚡ Quick Add", "tab3": "🏦 Balances", "tab4": "📜 History"}
+FLUSH_TIMEOUT = 120  # seconds to wait for the outbox to push a step's writes
+
+
+def _outbox_busy(db_path):
+    if not os.path.exists(db_path):
+        return False
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0] > 0
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+def _button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+
+def _text_input(at, **match):
+    return next(t for t in at.text_input if all(getattr(t, k) == v for k, v in match.items()))
+
+
+# AppTest doesn't keep the selected tab between runs the way the browser does; every run of a
+# tab step selects it again
+def _tab(at, tab):
+    at.session_state["main_tab"] = TABS[tab]
+    return at
+
+
+def _steps(at):
+    def tab1_save():
+        _tab(at, "tab1")
+        at.number_input[0].set_value(42.5)
+        _text_input(at, placeholder="e.g. E-Transfer").input("Benchmark groceries")
+        _button(at, "Submit Transaction").click().run()
+
+    def tab2_quick_add():
+        next(b for b in _tab(at, "tab2").button if b.label.startswith("Coffee (")).click().run()
+        _button(_tab(at, "tab2"), "✅ YES, ADD IT").click().run()
+
+    def tab3_month():
+        months = _tab(at, "tab3").selectbox(key="perf_month")
+        months.select_index(min(1, len(months.options) - 1)).run()
+
+    def tab4_delete():
+        _button(_tab(at, "tab4"), "Confirm Delete 🗑️").click().run()
+
+    def tab4_edit():
+        desc = next(t for t in _tab(at, "tab4").text_input if t.label == "Description" and t.placeholder != "e.g. E-Transfer")
+        desc.input("Benchmark edit")
+        _button(at, "💾 Update Transaction").click().run()
+
+    return [
+        ("rerun (no change)", lambda: at.run()),
+        ("tab1: save", tab1_save),
+        ("tab2: open", lambda: _tab(at, "tab2").run()),
+        ("tab2: quick add", tab2_quick_add),
+        ("tab3: open", lambda: _tab(at, "tab3").run()),
+        ("tab3: change month", tab3_month),
+        ("tab3: 24 month trend", lambda: _tab(at, "tab3").radio(key="perf_trend").set_value(24).run()),
+        ("tab4: open", lambda: _tab(at, "tab4").run()),
+        ("tab4: next page", lambda: _tab(at, "tab4").button(key="hist_next").click().run()),
+        ("tab4: filter owner", lambda: _tab(at, "tab4").selectbox(key="hist_owner").set_value("Lily").run()),
+        ("tab4: delete", tab4_delete),
+        ("tab4: edit", tab4_edit),
+        ("rerun (no change)", lambda: _tab(at, "tab4").run()),
+    ]
+
+
+# --- CONSISTENCY ---
+# Sheets whose rows differ from the mirror's copy of them (or that the mirror holds and the
+# spreadsheet doesn't have)
+def _mismatches(ss):
+    from mirror import clean_header, get_mirror, normalize_row
+
+    mirror = get_mirror()
+    found = []
+    for name in mirror.sheets():
+        ws = ss.sheets.get(name)
+        if ws is None:
+            found.append(name)
+            continue
+        header = clean_header(ws.rows[0]) if ws.rows else []
+        rows = [normalize_row(r, len(header)) for r in ws.rows[1:]]
+        while rows and all(v == "" for v in rows[-1]):
+            rows.pop()
+        held = mirror.rows(name, range(2, mirror.row_count(name) + 2))
+        if header != mirror.columns(name) or rows != held:
+            found.append(name)
+    return found
+
+
+# --- ONE LEDGER SIZE (child process) ---
+def run_size(rows, latency, jitter, quota_error_rate, memory, partitioned=True):
+    sys.path.insert(0, ROOT)
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP, default_timeout=600)
+    at.secrets["jimmy_pin"] = PIN
+    at.secrets["lily_pin"] = "2222"
+    at.secrets["gcp_service_account"] = {"type": "service_account"}
+
+    # Before fake_gspread brings in gspread and pandas, as on a fresh container
+    if memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    at.run()
+    results = [{
+        "step": "pin screen (cold)", "seconds": time.perf_counter() - started, "run_calls": 0, "background_calls": 0,
+        "peak_bytes": tracemalloc.get_traced_memory()[1] if memory else None,
+        "error": "; ".join(str(e.value)[:120] for e in list(at.exception) + list(at.error)),
+    }]
+    if memory:
+        tracemalloc.stop()
+
+    from bench import fake_gspread
+
+    db_path = os.environ["FINANCE_MIRROR_PATH"]
+    ss = fake_gspread.spreadsheet(rows, partitioned=partitioned, latency=latency, jitter=jitter,
+                                  quota_error_rate=quota_error_rate)
+    with fake_gspread.patched(ss):
+        def measure(name, action):
+            calls = ss.total_calls()
+            if memory:
+                tracemalloc.start()
+                tracemalloc.reset_peak()
+            started = time.perf_counter()
+            try:
+                action()
+                error = "; ".join(str(e.value)[:120] for e in list(at.exception) + list(at.error))
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"[:200]
+            elapsed = time.perf_counter() - started
+            peak = tracemalloc.get_traced_memory()[1] if memory else None
+            if memory:
+                tracemalloc.stop()
+            run_calls = ss.total_calls() - calls
+            deadline = time.monotonic() + FLUSH_TIMEOUT
+            while _outbox_busy(db_path) and time.monotonic() < deadline:
+                time.sleep(0.05)
+            results.append({
+                "step": name, "seconds": elapsed, "run_calls": run_calls,
+                "background_calls": ss.total_calls() - calls - run_calls, "peak_bytes": peak, "error": error,
+            })
+
+        measure("login (cold load)", lambda: at.text_input[0].input(PIN).run())
+        for name, action in _steps(at):
+            measure(name, action)
+        mismatches = _mismatches(ss)
+    return {"rows": rows, "steps": results, "quota_errors": sum(ss.errors.values()), "mismatches": mismatches}
+
+
+# --- DRIVER ---
+def _child(rows, args, memory):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, FINANCE_MIRROR_PATH=os.path.join(tmp, "finance_mirror.db"))
+        cmd = [sys.executable, "-m", "bench.run", "--child", str(rows), "--latency", str(args.latency),
+               "--jitter", str(args.jitter), "--quota-error-rate", str(args.quota_error_rate)]
+        if memory:
+            cmd.append("--memory")
+        if args.single_sheet:
+            cmd.append("--single-sheet")
+        proc = subprocess.run(cmd, cwd=ROOT, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-4000:])
+        raise SystemExit(f"benchmark for {rows} rows failed")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def report(result, peaks):
+    print(f"\n== {result['rows']:,} rows ==  (quota errors injected: {result['quota_errors']})")
+    print(f"{'step':<24}{'ms':>10}{'api (run)':>11}{'api (bg)':>10}{'peak MB':>10}  errors")
+    for i, s in enumerate(result["steps"]):
+        peak = f"{peaks[i] / 2**20:.1f}" if peaks and peaks[i] is not None else "-"
+        print(f"{s['step']:<24}{s['seconds'] * 1000:>10.0f}{s['run_calls']:>11}{s['background_calls']:>10}{peak:>10}  {s['error']}")
+    print("sheets differ from the mirror: " + ", ".join(result["mismatches"]) if result["mismatches"]
+          else "every sheet matches the mirror")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app against a fake spreadsheet.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every API call")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many extra seconds per call")
+    parser.add_argument("--quota-error-rate", type=float, default=0.0, help="share of API calls that fail with 429")
+    parser.add_argument("--single-sheet", action="store_true", help="start with every year in the Transaction sheet")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--json", help="also write the raw results here")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--memory", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        result = run_size(args.child, args.latency, args.jitter, args.quota_error_rate, args.memory,
+                          partitioned=not args.single_sheet)
+        print(json.dumps(result))
+        return
+
+    all_results = []
+    for rows in args.rows:
+        result = _child(rows, args, memory=False)
+        peaks = None
+        if not args.no_memory:
+            peaks = [s["peak_bytes"] for s in _child(rows, args, memory=True)["steps"]]
+            for s, peak in zip(result["steps"], peaks):
+                s["peak_bytes"] = peak
+        report(result, peaks)
+        all_results.append(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(all_results, f, indent=2)
+    failed = [f"{r['rows']:,} rows: {', '.join(r['mismatches'])}" for r in all_results if r["mismatches"]]
+    if failed:
+        raise SystemExit("sheet and mirror differ after the run (" + "; ".join(failed) + ")")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import re
+
+import pandas as pd
+import streamlit as st
+
+import partitions
+import tracing
+from ledger import column_letter, row_runs
+
+RULES_SHEET = "Category Rules"
+RULE_COLUMNS = ["Pattern", "Category"]
+MEMO_LIMIT = 50000  # normalized descriptions remembered per rule set
+KEEP_CATEGORIES = ("Income", "Transfer")  # decided by the accounts, never by a rule
+
+
+# "Tim Hortons #1234" and "TIM HORTONS 1234" look the same to the rules (and share a memo entry)
+def normalize(values):
+    text = pd.Series(values, dtype=object).fillna("").astype(str).str.lower()
+    return text.str.replace(r"[^a-z0-9&']+", " ", regex=True).str.strip()
+
+
+# Pattern cells are plain text matched anywhere in the normalized description, or a regular
+# expression when written as "re:<expression>". Rows higher up the sheet win.
+def _pattern(cell):
+    cell = str(cell).strip()
+    if cell.lower().startswith("re:"):
+        # Matching is case-insensitive anyway, and a flag can't sit mid-pattern once combined
+        return re.sub(r"^\(\?i\)", "", cell[3:].strip())
+    return re.escape(normalize([cell]).iloc[0])
+
+
+# --- CATEGORIZER ---
+# All rules compile into one regex: an alternation of lookaheads anchored at the start, one
+# named group per rule ("rule0", "rule1", ...), so the engine tries them in sheet order and the
+# first named group that captures names the rule; groups inside a rule's own expression are
+# ignored. A whole Series is classified with one str.extract call over its
+# distinct unseen descriptions; answers are memoized per normalized description.
+class Categorizer:
+    def __init__(self, rules):
+        self.categories = []
+        self.names = []
+        groups = []
+        for pattern, category in rules:
+            source = _pattern(pattern)
+            if not source or not category:
+                continue
+            group = f"(?=.*?(?P<rule{len(groups)}>{source}))"
+            # A rule that doesn't compile, or breaks the combined pattern (inline flags, a clashing
+            # group name), is left out rather than taking every other rule down with it
+            try:
+                re.compile(_combined(groups + [group]), re.I)
+            except re.error:
+                continue
+            groups.append(group)
+            self.names.append(f"rule{len(self.names)}")
+            self.categories.append(category)
+        self.regex = re.compile(_combined(groups), re.I) if groups else None
+        self.memo = {}
+
+    def __len__(self):
+        return len(self.categories)
+
+    @tracing.traced("categorize.classify")
+    def classify(self, descriptions):
+        keys = normalize(descriptions)
+        if self.regex is None:
+            return pd.Series(None, index=keys.index, dtype=object)
+        unseen = pd.Series(keys[~keys.isin(list(self.memo))].unique(), dtype=object)
+        if len(unseen):
+            if len(self.memo) + len(unseen) > MEMO_LIMIT:
+                self.memo.clear()
+            hits = unseen.str.extract(self.regex, expand=True)[self.names].notna()
+            matched = hits.any(axis=1)
+            found = pd.Series(None, index=unseen.index, dtype=object)
+            found[matched] = [self.categories[i] for i in hits[matched].to_numpy().argmax(axis=1)]
+            self.memo.update(zip(unseen, found))
+        return keys.map(self.memo)
+
+    def suggest(self, description):
+        return self.classify([description]).iloc[0]
+
+
+def _combined(groups):
+    return "^(?:" + "|".join(groups) + ")"
+
+
+# Rule rows come from the "Category Rules" snapshot; the tuple keys the shared cache so every
+# session reuses the compiled matcher and its memo until the rules change.
+def rules_from(df):
+    if df.empty or not set(RULE_COLUMNS) <= set(df.columns):
+        return ()
+    rules = df[RULE_COLUMNS].astype(str).apply(lambda col: col.str.strip())
+    rules = rules[(rules["Pattern"] != "") & (rules["Category"] != "")]
+    return tuple(rules.itertuples(index=False, name=None))
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_categorizer(rules):
+    return Categorizer(rules)
+
+
+# --- RE-CATEGORIZE HISTORY ---
+# Ledger rows whose category a rule would now change, as {sheet row: new category}.
+@tracing.traced("categorize.recategorize")
+def recategorize(categorizer, mirror, sheet="Transaction"):
+    if not len(categorizer) or "Category" not in mirror.columns(sheet):
+        return {}
+    df = mirror.query('SELECT _row, "Category", "Description" FROM {' + sheet + '}')
+    if df.empty:
+        return {}
+    new = categorizer.classify(df["Description"])
+    changed = new.notna() & (new != df["Category"].astype(str)) & ~df["Category"].isin(KEEP_CATEGORIES)
+    changed &= ~new.isin(KEEP_CATEGORIES)
+    return dict(zip(df["_row"][changed].astype(int), new[changed]))
+
+
+# The same over the hot sheet and every archive, as {sheet: {sheet row: new category}}
+def recategorize_all(categorizer, mirror):
+    changes = {}
+    for sheet in partitions.partitions(mirror.sheets()):
+        found = recategorize(categorizer, mirror, sheet)
+        if found:
+            changes[sheet] = found
+    return changes
+
+
+# One batch_update range per run of consecutive rows in the Category column
+def category_ranges(mirror, changes, sheet="Transaction"):
+    letter = column_letter(mirror.columns(sheet).index("Category") + 1)
+    return [
+        {"range": f"{letter}{run[0]}:{letter}{run[-1]}", "values": [[changes[r]] for r in run]}
+        for run in row_runs(changes)
+    ]
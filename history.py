@@ -0,0 +1,86 @@
+import pandas as pd
+
+import partitions
+import schema
+import tracing
+
+PAGE_SIZE = 15
+
+
+# --- HISTORY QUERIES ---
+# Filtering and paging happen in SQLite, so only the rows on screen become a DataFrame.
+# Dates are compared as ISO text (how the app writes them). Archived years are searched after
+# the hot sheet, newest first, and only when the page reaches them or the dates ask for them.
+def _where(start=None, end=None, owner=None, account=None, category=None):
+    clauses, params = [], []
+    if start:
+        clauses.append('"Date" >= ?')
+        params.append(str(start))
+    if end:
+        clauses.append('"Date" <= ?')
+        params.append(str(end))
+    if owner:
+        clauses.append('"Owner" = ?')
+        params.append(owner)
+    if account:
+        # account is (owner, account name). Rows store the bare name with the row's Owner, edits
+        # may have saved the full "Owner - Account" name (the same keys as balances.ledger_legs)
+        acc_owner, name = account
+        full = f"{acc_owner} - {name}"
+        clauses.append('("From" = ? OR "To" = ? OR ("Owner" = ? AND ("From" = ? OR "To" = ?)))')
+        params.extend([full, full, acc_owner, name, name])
+    if category:
+        clauses.append('"Category" = ?')
+        params.append(category)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def _sheets(mirror, filters):
+    return partitions.partitions(mirror.sheets(), filters.get("start"), filters.get("end"))
+
+
+def _count(mirror, sheet, where, params):
+    return int(mirror.query(f"SELECT COUNT(*) AS n FROM {{{sheet}}}" + where, params)["n"].iloc[0])
+
+
+@tracing.traced("history.count")
+def count(mirror, **filters):
+    where, params = _where(**filters)
+    return sum(_count(mirror, sheet, where, params) for sheet in _sheets(mirror, filters))
+
+
+@tracing.traced("history.page")
+def page(mirror, page_num, page_size=PAGE_SIZE, **filters):
+    where, params = _where(**filters)
+    offset, wanted, frames = page_num * page_size, page_size, []
+    for sheet in _sheets(mirror, filters):
+        if wanted == 0:
+            break
+        if offset:
+            # Whole partitions before the page are skipped on their count alone
+            n = _count(mirror, sheet, where, params)
+            if offset >= n:
+                offset -= n
+                continue
+        part = mirror.query(
+            f"SELECT * FROM {{{sheet}}}" + where + " ORDER BY _row DESC LIMIT ? OFFSET ?", params + [wanted, offset]
+        )
+        part["_sheet"] = sheet
+        frames.append(part)
+        offset, wanted = 0, wanted - len(part)
+    if not frames:
+        frames.append(mirror.query("SELECT * FROM {Transaction} LIMIT 0").assign(_sheet=""))
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    # Pickers select by Key: the transaction ID, or the sheet and row number for rows not yet
+    # given one
+    archived = df["_sheet"] != partitions.HOT_SHEET
+    df["Key"] = "row-" + df["_row"].astype(str)
+    df.loc[archived, "Key"] = df["_sheet"] + ":" + df["Key"]
+    if "ID" in df.columns:
+        ids = df["ID"].fillna("").astype(str)
+        df["Key"] = ids.where(ids != "", df["Key"])
+    df["Label"] = (
+        (df["_sheet"] + " · ").where(archived, "") + "Row " + df["_row"].astype(str) + ": " + df["Date"].astype(str) + " | "
+        + df["Description"].astype(str) + " | $" + df["Amount"].astype(str)
+    )
+    return schema.typed_ledger(df)
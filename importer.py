@@ -0,0 +1,165 @@
+import io
+import re
+
+import pandas as pd
+
+import schema
+import tracing
+from rollup import parse_amounts, parse_dates
+
+LEDGER_COLUMNS = ["Date", "Owner", "From", "To", "Category", "Description", "Amount"]
+
+# Header names banks use for each field, checked in order
+DATE_NAMES = ["date", "transaction date", "posted date", "posting date", "trans date"]
+DESC_NAMES = ["description", "description 1", "payee", "name", "memo", "details", "merchant"]
+AMOUNT_NAMES = ["amount", "cad$", "amount (cad)", "transaction amount"]
+DEBIT_NAMES = ["debit", "withdrawal", "withdrawals", "money out"]
+CREDIT_NAMES = ["credit", "deposit", "deposits", "money in"]
+ACCOUNT_NAMES = ["account", "account number", "account name", "card"]
+
+
+def _pick(columns, names):
+    lowered = {c.strip().lower(): c for c in columns}
+    for name in names:
+        if name in lowered:
+            return lowered[name]
+    return None
+
+
+def _signed_amounts(values):
+    # "(12.50)" is how some banks write a withdrawal
+    text = pd.Series(values).astype(str).str.strip()
+    negative = text.str.match(r"^\(.*\)$")
+    amounts = parse_amounts(text.str.strip("()"))
+    return amounts.where(~negative, -amounts)
+
+
+# --- PARSERS ---
+# Both return one row per statement line: Date (ISO text), Description, Amount (signed,
+# negative = money out) and Source (the bank's account name/number, or "").
+def read_csv(data):
+    df = pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False, skipinitialspace=True)
+    date_col = _pick(df.columns, DATE_NAMES)
+    desc_col = _pick(df.columns, DESC_NAMES)
+    if date_col is None or desc_col is None:
+        raise ValueError("Couldn't find the date and description columns in this CSV.")
+
+    amount_col = _pick(df.columns, AMOUNT_NAMES)
+    if amount_col is not None:
+        amounts = _signed_amounts(df[amount_col])
+    else:
+        debit_col, credit_col = _pick(df.columns, DEBIT_NAMES), _pick(df.columns, CREDIT_NAMES)
+        if debit_col is None and credit_col is None:
+            raise ValueError("Couldn't find an amount (or debit/credit) column in this CSV.")
+        debits = parse_amounts(df[debit_col]).abs() if debit_col else 0
+        credits = parse_amounts(df[credit_col]).abs() if credit_col else 0
+        amounts = credits - debits
+
+    account_col = _pick(df.columns, ACCOUNT_NAMES)
+    return pd.DataFrame({
+        "Date": parse_dates(df[date_col]).dt.strftime("%Y-%m-%d"),
+        "Description": df[desc_col].str.strip(),
+        "Amount": amounts,
+        "Source": df[account_col].str.strip() if account_col else "",
+    })
+
+
+OFX_FIELDS = {
+    "Date": r"<DTPOSTED>\s*(\d{8})",
+    "Amount": r"<TRNAMT>\s*([^<\r\n]+)",
+    "Name": r"<NAME>\s*([^<\r\n]+)",
+    "Memo": r"<MEMO>\s*([^<\r\n]+)",
+}
+
+
+def read_ofx(data):
+    text = data.decode("utf-8", errors="replace")
+    blocks = pd.Series(re.findall(r"<STMTTRN>(.*?)(?:</STMTTRN>|(?=<STMTTRN>)|</BANKTRANLIST>)", text, re.S | re.I))
+    if blocks.empty:
+        raise ValueError("No transactions found in this OFX file.")
+    fields = pd.DataFrame({
+        name: blocks.str.extract(pattern, flags=re.I, expand=False).fillna("").str.strip()
+        for name, pattern in OFX_FIELDS.items()
+    })
+    account = re.search(r"<ACCTID>\s*([^<\r\n]+)", text, re.I)
+    return pd.DataFrame({
+        "Date": pd.to_datetime(fields["Date"], format="%Y%m%d", errors="coerce").dt.strftime("%Y-%m-%d"),
+        "Description": fields["Name"].where(fields["Name"] != "", fields["Memo"]),
+        "Amount": parse_amounts(fields["Amount"]),
+        "Source": account.group(1).strip() if account else "",
+    })
+
+
+@tracing.traced("importer.read_statement")
+def read_statement(name, data):
+    if name.lower().endswith((".ofx", ".qfx")):
+        df = read_ofx(data)
+    else:
+        df = read_csv(data)
+    return df[df["Date"].notna() & (df["Amount"] != 0)].reset_index(drop=True)
+
+
+# --- ACCOUNT MAPPING ---
+# Source names like "VISA ...1234" or "Chequing" are matched to an "Owner - Account" option
+# by the account part, the same split parse_account_string makes.
+def guess_account(source, account_options, parse_account_string):
+    source_l = str(source).lower()
+    if source_l:
+        for option in account_options:
+            _, account = parse_account_string(option, "")
+            if account.lower() in source_l or source_l in account.lower():
+                return option
+    return None
+
+
+# --- LEDGER ROWS ---
+# Same shape save_transaction writes: money out leaves the account to "External Merchant",
+# money in arrives from "External Source" as Income. Account names are stored without owner.
+# rule_categories (aligned with df) overrides spend_category for spending rows a rule matched.
+def to_ledger_rows(df, account_for_source, parse_account_string, default_owner, spend_category, rule_categories=None):
+    options = df["Source"].map(account_for_source)
+    split = options.map(lambda opt: parse_account_string(opt, default_owner))
+    owners = split.str[0]
+    accounts = split.str[1]
+    money_out = df["Amount"] < 0
+    spend = pd.Series(spend_category, index=df.index, dtype=object)
+    if rule_categories is not None:
+        spend = rule_categories.where(rule_categories.notna() & (rule_categories != "Income"), spend)
+    return pd.DataFrame({
+        "Date": df["Date"],
+        "Owner": owners,
+        "From": accounts.where(money_out, "External Source"),
+        "To": accounts.where(~money_out, "External Merchant"),
+        "Category": spend.where(money_out, "Income"),
+        "Description": df["Description"],
+        "Amount": df["Amount"].abs().round(2),
+    })[LEDGER_COLUMNS]
+
+
+# --- DE-DUPLICATION ---
+# Fingerprint of (date, amount in cents, description, account); the account is whichever
+# side of the row isn't External Source/Merchant.
+# Works on typed frames (schema.typed_ledger), so the ledger itself is never re-parsed
+def fingerprints(df):
+    from_acc = df["From"].astype(str)
+    account = from_acc.where(~from_acc.isin(["External Source", ""]), df["To"].astype(str))
+    key = (
+        df["Date"].dt.strftime("%Y-%m-%d").fillna("") + "|"
+        + df["Cents"].astype(str) + "|"
+        + df["Description"].astype(str).str.strip().str.lower() + "|"
+        + account.str.strip().str.lower()
+    )
+    return pd.util.hash_pandas_object(key, index=False)
+
+
+# ledger_dfs: the typed frames of every partition the statement's dates fall in
+@tracing.traced("importer.drop_existing")
+def drop_existing(rows, ledger_dfs):
+    existing = set()
+    for df in ledger_dfs:
+        if not df.empty:
+            existing.update(fingerprints(df))
+    if rows.empty or not existing:
+        return rows, 0
+    is_new = ~fingerprints(schema.typed_ledger(rows)).isin(existing)
+    return rows[is_new].reset_index(drop=True), int((~is_new).sum())
@@ -0,0 +1,101 @@
+import uuid
+
+from gspread.utils import rowcol_to_a1
+
+import tracing
+
+SHEET = "Transaction"
+ID_COLUMN = "ID"
+
+
+def new_id():
+    return uuid.uuid4().hex[:12]
+
+
+def column_letter(col):
+    return rowcol_to_a1(1, col).rstrip("1")
+
+
+# Sheet rows grouped into runs of consecutive rows, in order: one range (or one delete) per run
+# keeps a request small
+def row_runs(rows):
+    runs = []
+    for row in sorted(rows):
+        if runs and runs[-1][-1] == row - 1:
+            runs[-1].append(row)
+        else:
+            runs.append([row])
+    return runs
+
+
+# 1-based position of the ID column, None if the sheet has none
+def id_col(header):
+    return header.index(ID_COLUMN) + 1 if ID_COLUMN in header else None
+
+
+# New rows are built in sheet column order; this drops a fresh ID into the ID column.
+def with_ids(rows, header):
+    if ID_COLUMN not in header:
+        return [list(r) for r in rows]
+    pos = header.index(ID_COLUMN)
+    out = []
+    for r in rows:
+        r = list(r) + [""] * (pos + 1 - len(r))
+        r[pos] = new_id()
+        out.append(r)
+    return out
+
+
+# --- ID BACKFILL ---
+# Older ledgers have no ID column, and rows typed straight into the sheet have no ID.
+# Give them one with a single batched write, and patch the mirror so edits can use it now.
+@tracing.traced("ledger.ensure_ids")
+def ensure_ids(mirror, outbox, user=""):
+    header = mirror.columns(SHEET)
+    if not header or mirror.row_count(SHEET) == 0 or outbox.has_pending(SHEET):
+        return 0
+    if ID_COLUMN in header:
+        col = header.index(ID_COLUMN) + 1
+        missing = mirror.query(
+            'SELECT _row FROM {Transaction} WHERE "ID" IS NULL OR "ID" = \'\' ORDER BY _row'
+        )["_row"].tolist()
+    else:
+        col = len(header) + 1
+        missing = mirror.query("SELECT _row FROM {Transaction} ORDER BY _row")["_row"].tolist()
+    if not missing:
+        return 0
+
+    ids = {int(row): new_id() for row in missing}
+    letter = column_letter(col)
+    data = [] if ID_COLUMN in header else [{"range": f"{letter}1", "values": [[ID_COLUMN]]}]
+    for run in row_runs(ids):
+        data.append({
+            "range": f"{letter}{run[0]}:{letter}{run[-1]}",
+            "values": [[ids[row]] for row in run],
+        })
+    outbox.enqueue(SHEET, "batch", {"data": data}, f"Add IDs to {len(ids)} transactions", user)
+    mirror.fill_column(SHEET, ID_COLUMN, ids)
+    return len(ids)
+
+
+# --- COMPARE-AND-SWAP TARGETS ---
+# Edits and deletes carry the transaction ID and the row version (hash) the user was looking
+# at. Returns the outbox payload for the row, or None if it moved on since then. Archived
+# transactions pass their archive sheet.
+def cas_target(mirror, txn_id, seen_version, fallback_row=None, sheet=SHEET):
+    if txn_id:
+        found = mirror.locate(sheet, txn_id)
+    else:
+        fallback_row = int(fallback_row) if fallback_row else None
+        row = mirror.row(sheet, fallback_row) if fallback_row else None
+        found = (fallback_row, mirror.row_version(sheet, fallback_row)) if row else None
+    if found is None or found[1] != seen_version:
+        return None
+    header = mirror.columns(sheet)
+    return {
+        "row": found[0],
+        "id": txn_id or None,
+        "version": seen_version,
+        "width": len(header),
+        "id_col": id_col(header),
+    }
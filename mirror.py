@@ -0,0 +1,508 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+import streamlit as st
+from gspread.utils import DateTimeOption, ValueRenderOption, absolute_range_name, rowcol_to_a1
+
+import partitions
+import tracing
+from balances import BalanceCheckpoints
+from ledger import ID_COLUMN, SHEET
+from rollup import MonthlyRollup
+
+# --- CONFIGURATION ---
+# FINANCE_MIRROR_PATH points the mirror elsewhere (the benchmarks use a scratch copy)
+MIRROR_PATH = os.environ.get(
+    "FINANCE_MIRROR_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "finance_mirror.db")
+)
+FULL_SYNC_INTERVAL = 900  # seconds between full reconciles that catch edits made directly in the sheet
+SHARED_SYNC_WINDOW = 2  # a sync this recent (by another session) is reused instead of asking again
+KEY_COLUMNS = {SHEET: ID_COLUMN}  # stable row keys, indexed in memory by locate() (archives share them)
+
+# Numbers come back as numbers (no "$1,200.00" strings), dates as the text shown in the sheet
+READ_OPTS = {
+    "value_render_option": ValueRenderOption.unformatted,
+    "date_time_render_option": DateTimeOption.formatted_string,
+}
+
+
+def table_name(sheet):
+    return "sheet_" + re.sub(r"\W+", "_", sheet.strip().lower())
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def clean_header(cells):
+    header = [str(c).strip() for c in cells]
+    while header and header[-1] == "":
+        header.pop()
+    return [h or f"Column {i + 1}" for i, h in enumerate(header)]
+
+
+def normalize_row(values, width):
+    row = []
+    for v in list(values)[:width]:
+        if v is None:
+            v = ""
+        elif isinstance(v, float) and v.is_integer():
+            v = int(v)
+        row.append(v)
+    return row + [""] * (width - len(row))
+
+
+def row_hash(row):
+    return hashlib.sha1(json.dumps(row, default=str).encode()).hexdigest()
+
+
+# --- SQLITE MIRROR ---
+# Local copy of each worksheet, keyed by sheet row number (row 1 is the header, so the first
+# record is row 2). Reads never leave the process; syncs only fetch what changed.
+# Hooks registered for a sheet see every row that is removed or added, inside the same
+# SQLite transaction, so derived tables (e.g. the monthly rollup) never drift from the rows.
+class Mirror:
+    def __init__(self, path):
+        self.hooks = {}
+        self.key_index = {}  # sheet -> {key: sheet_row}, built on first locate()
+        self.synced_at = {}  # sheet -> monotonic time of the last successful sync
+        self.versions = {}  # sheet -> change counter, bumped whenever mirrored rows change
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sheet_meta ("
+            "sheet TEXT PRIMARY KEY, header TEXT, row_count INTEGER, full_synced_at REAL, stale INTEGER DEFAULT 0)"
+        )
+        self.conn.commit()
+
+    def meta(self, sheet):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT header, row_count, full_synced_at, stale FROM sheet_meta WHERE sheet = ?", (sheet,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"header": json.loads(row[0]), "row_count": row[1], "full_synced_at": row[2], "stale": bool(row[3])}
+
+    def columns(self, sheet):
+        meta = self.meta(sheet)
+        return meta["header"] if meta else []
+
+    def row_count(self, sheet):
+        meta = self.meta(sheet)
+        return meta["row_count"] if meta else 0
+
+    def sheets(self):
+        with self.lock:
+            return [r[0] for r in self.conn.execute("SELECT sheet FROM sheet_meta").fetchall()]
+
+    # Archive sheets ("Transaction 2024") feed the same hooks as the hot sheet
+    def _hooks(self, sheet):
+        return self.hooks.get(partitions.hot_sheet(sheet), [])
+
+    def _key_column(self, sheet):
+        return KEY_COLUMNS.get(partitions.hot_sheet(sheet))
+
+    def register(self, sheet, hook):
+        with self.lock:
+            self.hooks.setdefault(sheet, []).append(hook)
+            hook.attach(self, sheet)
+            self.conn.commit()
+
+    def mark_stale(self, sheet=None):
+        with self.lock:
+            if sheet is None:
+                self.conn.execute("UPDATE sheet_meta SET stale = 1")
+            else:
+                self.conn.execute("UPDATE sheet_meta SET stale = 1 WHERE sheet = ?", (sheet,))
+            self.conn.commit()
+
+    def _reset_table(self, sheet, header):
+        t = quote(table_name(sheet))
+        cols = ", ".join(quote(h) for h in header)
+        self._forget_rows(sheet)
+        self.conn.execute(f"DROP TABLE IF EXISTS {t}")
+        self.conn.execute(f"CREATE TABLE {t} (_row INTEGER PRIMARY KEY, _hash TEXT, {cols})")
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sheet_meta (sheet, header, row_count, full_synced_at, stale) VALUES (?, ?, 0, 0, 0)",
+            (sheet, json.dumps(header)),
+        )
+        self.key_index.pop(sheet, None)
+        self._bump(sheet)
+
+    # Take this sheet's rows out of the derived tables; other sheets feeding them keep theirs
+    def _forget_rows(self, sheet):
+        old = self.meta(sheet)
+        if old is not None and self._hooks(sheet):
+            self._notify(sheet, old["header"], self._fetch_rows(sheet, "1"), [])
+
+    # For a table the spreadsheet has no sheet for (rows moved into an archive whose write
+    # never happened): its rows leave the derived tables and the table goes
+    def drop(self, sheet):
+        with self.lock:
+            if self.meta(sheet) is None:
+                return
+            self._forget_rows(sheet)
+            self.conn.execute(f"DROP TABLE IF EXISTS {quote(table_name(sheet))}")
+            self.conn.execute("DELETE FROM sheet_meta WHERE sheet = ?", (sheet,))
+            self.conn.commit()
+            self.key_index.pop(sheet, None)
+            self.synced_at.pop(sheet, None)
+            self._bump(sheet)
+
+    def _bump(self, sheet):
+        self.versions[sheet] = self.versions.get(sheet, 0) + 1
+
+    # Changes with every write to the sheet's rows, so cached frames can tell they are behind
+    def version(self, sheet):
+        return self.versions.get(sheet, 0)
+
+    def _fetch_rows(self, sheet, where, params=()):
+        cur = self.conn.execute(f"SELECT * FROM {quote(table_name(sheet))} WHERE {where}", params)
+        return [list(r[2:]) for r in cur.fetchall()]
+
+    def _notify(self, sheet, header, removed, added):
+        for hook in self._hooks(sheet):
+            hook.change(self.conn, header, removed, added)
+
+    # numbered_rows: [(sheet_row, values), ...]
+    def _write_rows(self, sheet, header, numbered_rows):
+        hooked = bool(self._hooks(sheet))
+        if hooked:
+            nums = json.dumps([n for n, _ in numbered_rows])
+            removed = self._fetch_rows(sheet, "_row IN (SELECT value FROM json_each(?))", (nums,))
+        marks = ", ".join("?" * (len(header) + 2))
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO {quote(table_name(sheet))} VALUES ({marks})",
+            [(n, row_hash(r), *r) for n, r in numbered_rows],
+        )
+        if hooked:
+            self._notify(sheet, header, removed, [r for _, r in numbered_rows])
+        if numbered_rows:
+            self._bump(sheet)
+        index = self.key_index.get(sheet)
+        if index is not None and self._key_column(sheet) in header:
+            pos = header.index(self._key_column(sheet))
+            for n, r in numbered_rows:
+                if r[pos] != "":
+                    index[str(r[pos])] = n
+
+    def _set_meta(self, sheet, **fields):
+        sets = ", ".join(f"{k} = ?" for k in fields)
+        self.conn.execute(f"UPDATE sheet_meta SET {sets} WHERE sheet = ?", (*fields.values(), sheet))
+
+    # --- SYNC ---
+    def sync(self, ws, force_full=False):
+        return self.sync_batch(None, [ws], force_full).get(ws.title, 0)
+
+    # Several sheets in one values request (fetch: A1 ranges -> one grid per range, e.g.
+    # SheetsClient.batch_get; None reads each worksheet on its own): the header and tail of each
+    # sheet that only needs its new rows, the whole of each sheet due a full reconcile. A sheet
+    # whose tail doesn't line up falls back to a full sync. Returns {sheet: rows added or changed}.
+    # The lock is only held to plan and to apply: the read itself runs without it, so queries and
+    # writes go on during a slow or retried request and sessions reading the same ranges share it.
+    def sync_batch(self, fetch, worksheets, force_full=False):
+        with self.lock:
+            plans = []
+            for ws in worksheets:
+                meta = self.meta(ws.title)
+                if self._recent(ws.title, meta, force_full):
+                    continue
+                ranges = None if self._needs_full(meta, force_full) else self._tail_ranges(meta)
+                plans.append((ws, meta, self.version(ws.title), ranges))
+        if not plans:
+            return {}
+
+        if fetch is not None:
+            grids = fetch([
+                absolute_range_name(ws.title, r) for ws, _, _, ranges in plans for r in ranges or [None]
+            ], **READ_OPTS)
+        else:
+            grids = []
+            for ws, _, _, ranges in plans:
+                grids += ws.batch_get(ranges, **READ_OPTS) if ranges else [ws.get_all_values(**READ_OPTS)]
+
+        added, retry = {}, []
+        with self.lock:
+            for ws, meta, version, ranges in plans:
+                got, grids = grids[:len(ranges or [None])], grids[len(ranges or [None]):]
+                # Written to or synced by someone else while we were reading: what we read may
+                # be behind the table now, so leave it be
+                if self.meta(ws.title) != meta or self.version(ws.title) != version:
+                    continue
+                if ranges is None:
+                    with tracing.span("mirror.full_sync", sheet=ws.title) as attrs:
+                        added[ws.title] = attrs["rows"] = self._load_values(ws.title, got[0])
+                else:
+                    added[ws.title] = self._apply_tail(ws.title, meta, *got)
+                    if added[ws.title] is None:
+                        retry.append(ws)
+                        continue
+                self.synced_at[ws.title] = time.monotonic()
+        if retry:
+            added.update(self.sync_batch(fetch, retry, force_full=True))
+        return added
+
+    # Sessions loading the same sheet at once share one read; the ones that come just after it
+    # reuse the sync that just finished
+    def _recent(self, sheet, meta, force_full):
+        recent = time.monotonic() - self.synced_at.get(sheet, -SHARED_SYNC_WINDOW) < SHARED_SYNC_WINDOW
+        return recent and not force_full and meta is not None and not meta["stale"]
+
+    def _needs_full(self, meta, force_full):
+        return (
+            force_full or meta is None or meta["stale"]
+            or time.time() - meta["full_synced_at"] > FULL_SYNC_INTERVAL
+        )
+
+    # The tail range starts on the last row we already hold, so one request returns the
+    # header, an anchor row to verify and everything appended after it.
+    def _tail_ranges(self, meta):
+        last_col = rowcol_to_a1(1, len(meta["header"])).rstrip("1")
+        tail_start = meta["row_count"] + 1 if meta["row_count"] else 2
+        return [f"A1:{last_col}1", f"A{tail_start}:{last_col}"]
+
+    # Stores the rows after the ones we hold; None if the sheet needs a full sync instead
+    def _apply_tail(self, sheet, meta, head_vr, tail_vr):
+        header, count = meta["header"], meta["row_count"]
+        if clean_header(head_vr[0] if head_vr else []) != header:
+            return None
+
+        tail = [normalize_row(r, len(header)) for r in tail_vr]
+        if count:
+            stored = self.conn.execute(
+                f"SELECT _hash FROM {quote(table_name(sheet))} WHERE _row = ?", (count + 1,)
+            ).fetchone()
+            # Anchor gone or changed: rows were deleted or shifted outside the app
+            if not tail or stored is None or row_hash(tail[0]) != stored[0]:
+                return None
+            tail = tail[1:]
+
+        if tail:
+            self._write_rows(sheet, header, list(enumerate(tail, start=count + 2)))
+            self._set_meta(sheet, row_count=count + len(tail))
+            self.conn.commit()
+        return len(tail)
+
+    # Reconciles the table with the sheet's whole value grid (rows may be ragged, as the API
+    # leaves out trailing empty cells)
+    def _load_values(self, sheet, values):
+        header = clean_header(values[0]) if values else []
+        rows = [normalize_row(r, len(header)) for r in values[1:]]
+        while rows and all(v == "" for v in rows[-1]):
+            rows.pop()
+
+        meta = self.meta(sheet)
+        if meta is None or meta["header"] != header:
+            self._reset_table(sheet, header)
+        t = quote(table_name(sheet))
+        known = dict(self.conn.execute(f"SELECT _row, _hash FROM {t}").fetchall())
+        changed = [(i + 2, r) for i, r in enumerate(rows) if known.get(i + 2) != row_hash(r)]
+        if changed:
+            self._write_rows(sheet, header, changed)
+        if self._hooks(sheet):
+            removed = self._fetch_rows(sheet, "_row > ?", (len(rows) + 1,))
+            if removed:
+                self._notify(sheet, header, removed, [])
+        if self.conn.execute(f"DELETE FROM {t} WHERE _row > ?", (len(rows) + 1,)).rowcount:
+            self._bump(sheet)
+        self._set_meta(sheet, row_count=len(rows), full_synced_at=time.time(), stale=0)
+        self.key_index.pop(sheet, None)
+        self.conn.commit()
+        return len(changed)
+
+    # --- WRITE-THROUGH PATCHES ---
+    def append_rows(self, sheet, rows, start_row=None):
+        with self.lock:
+            meta = self.meta(sheet)
+            if meta is None:
+                return
+            expected = meta["row_count"] + 2
+            if start_row is not None and start_row != expected:
+                # The sheet put the rows somewhere we did not expect (blank rows, external edits)
+                self.mark_stale(sheet)
+                return
+            width = len(meta["header"])
+            self._write_rows(sheet, meta["header"], list(enumerate((normalize_row(r, width) for r in rows), start=expected)))
+            self._set_meta(sheet, row_count=meta["row_count"] + len(rows))
+            self.conn.commit()
+
+    def update_row(self, sheet, sheet_row, values):
+        with self.lock:
+            meta = self.meta(sheet)
+            if meta is None:
+                return
+            header = meta["header"]
+            current = self.row(sheet, sheet_row)
+            if current is None:
+                self.mark_stale(sheet)
+                return
+            merged = list(values) + [current[h] for h in header[len(values):]]
+            self._write_rows(sheet, header, [(sheet_row, normalize_row(merged, len(header)))])
+            self.conn.commit()
+
+    def delete_row(self, sheet, sheet_row):
+        with self.lock:
+            meta = self.meta(sheet)
+            if meta is None:
+                return
+            t = quote(table_name(sheet))
+            if self._hooks(sheet):
+                self._notify(sheet, meta["header"], self._fetch_rows(sheet, "_row = ?", (sheet_row,)), [])
+            self.conn.execute(f"DELETE FROM {t} WHERE _row = ?", (sheet_row,))
+            # Rows below move up one, like the sheet. Negate first so the primary key never collides.
+            self.conn.execute(f"UPDATE {t} SET _row = -(_row - 1) WHERE _row > ?", (sheet_row,))
+            self.conn.execute(f"UPDATE {t} SET _row = -_row WHERE _row < 0")
+            self._set_meta(sheet, row_count=max(meta["row_count"] - 1, 0))
+            self.conn.commit()
+            self._bump(sheet)
+            index = self.key_index.get(sheet)
+            if index is not None:
+                self.key_index[sheet] = {k: r - 1 if r > sheet_row else r for k, r in index.items() if r != sheet_row}
+
+    # Sets one column on the given rows (adding the column if the sheet has none yet),
+    # e.g. backfilling IDs. values_by_row: {sheet_row: value}
+    def fill_column(self, sheet, name, values_by_row):
+        with self.lock:
+            meta = self.meta(sheet)
+            if meta is None:
+                return
+            header = meta["header"]
+            t = quote(table_name(sheet))
+            if name not in header:
+                self.conn.execute(f"ALTER TABLE {t} ADD COLUMN {quote(name)} DEFAULT ''")
+                header = header + [name]
+                self._set_meta(sheet, header=json.dumps(header))
+            pos = header.index(name)
+            nums = json.dumps(list(values_by_row))
+            cur = self.conn.execute(f"SELECT * FROM {t} WHERE _row IN (SELECT value FROM json_each(?))", (nums,))
+            numbered = []
+            for r in cur.fetchall():
+                values = normalize_row(r[2:], len(header))
+                values[pos] = values_by_row[r[0]]
+                numbered.append((r[0], values))
+            self._write_rows(sheet, header, numbered)
+            self.conn.commit()
+            self.key_index.pop(sheet, None)
+
+    # Moves rows to another sheet's table, e.g. a closed year to its archive sheet. The rows
+    # go after the target's last row (in the target's column order) and the rows left behind
+    # close up like the sheet. The target table is created if the mirror has none yet.
+    def move_rows(self, sheet, target, sheet_rows):
+        with self.lock:
+            meta = self.meta(sheet)
+            if meta is None or not sheet_rows:
+                return
+            target_meta = self.meta(target)
+            if target_meta is None:
+                self._reset_table(target, meta["header"])
+                target_meta = self.meta(target)
+            moved = self.rows(sheet, sheet_rows)
+            placed = self.rows(sheet, sheet_rows, target_meta["header"])
+            self._write_rows(target, target_meta["header"], list(enumerate(placed, start=target_meta["row_count"] + 2)))
+            self._set_meta(target, row_count=target_meta["row_count"] + len(moved))
+
+            t = quote(table_name(sheet))
+            nums = json.dumps(sorted(sheet_rows))
+            self._notify(sheet, meta["header"], moved, [])
+            self.conn.execute(f"DELETE FROM {t} WHERE _row IN (SELECT value FROM json_each(?))", (nums,))
+            # Number what is left 2, 3, ... in order; negated first so the primary key never collides
+            self.conn.execute(
+                f"UPDATE {t} SET _row = -n.new FROM (SELECT _row AS old, ROW_NUMBER() OVER (ORDER BY _row) + 1 AS new "
+                f"FROM {t}) AS n WHERE {t}._row = n.old"
+            )
+            self.conn.execute(f"UPDATE {t} SET _row = -_row WHERE _row < 0")
+            self._set_meta(sheet, row_count=meta["row_count"] - len(moved))
+            self.conn.commit()
+            self._bump(sheet)
+            self.key_index.pop(sheet, None)
+            self.key_index.pop(target, None)
+
+    # --- READS ---
+    @tracing.traced("mirror.frame")
+    def frame(self, sheet):
+        meta = self.meta(sheet)
+        if meta is None or not meta["header"]:
+            return pd.DataFrame()
+        with self.lock:
+            df = pd.read_sql_query(f"SELECT * FROM {quote(table_name(sheet))} ORDER BY _row", self.conn)
+        if df.empty:
+            return pd.DataFrame()
+        return df.drop(columns=["_row", "_hash"])
+
+    def row(self, sheet, sheet_row):
+        with self.lock:
+            cur = self.conn.execute(f"SELECT * FROM {quote(table_name(sheet))} WHERE _row = ?", (sheet_row,))
+            values = cur.fetchone()
+            names = [d[0] for d in cur.description]
+        if values is None:
+            return None
+        return {k: v for k, v in zip(names, values) if k != "_hash"}
+
+    # Changes whenever the header or any row of the sheet does; survives restarts, unlike version()
+    def digest(self, sheet):
+        with self.lock:
+            found = self.conn.execute(
+                f"SELECT group_concat(_hash, '') FROM (SELECT _hash FROM {quote(table_name(sheet))} ORDER BY _row)"
+            ).fetchone()
+        return hashlib.sha1((json.dumps(self.columns(sheet)) + (found[0] or "")).encode()).hexdigest()
+
+    # Values of the given rows in row order, in the sheet's columns or mapped onto another header
+    def rows(self, sheet, sheet_rows, header=None):
+        with self.lock:
+            rows = self._fetch_rows(sheet, "_row IN (SELECT value FROM json_each(?)) ORDER BY _row", (json.dumps(sorted(sheet_rows)),))
+            own = self.columns(sheet)
+        if header is None or header == own:
+            return rows
+        return [normalize_row([dict(zip(own, r)).get(h, "") for h in header], len(header)) for r in rows]
+
+    def row_version(self, sheet, sheet_row):
+        with self.lock:
+            found = self.conn.execute(
+                f"SELECT _hash FROM {quote(table_name(sheet))} WHERE _row = ?", (sheet_row,)
+            ).fetchone()
+        return found[0] if found else None
+
+    # Current (sheet_row, row hash) for a key, or None. The hash is the row's version for
+    # compare-and-swap edits. Entries are checked against the row, so a stale index rebuilds.
+    def locate(self, sheet, key):
+        column = self._key_column(sheet)
+        if column is None or not key or column not in self.columns(sheet):
+            return None
+        t = quote(table_name(sheet))
+        with self.lock:
+            for attempt in range(2):
+                if sheet not in self.key_index:
+                    cur = self.conn.execute(f"SELECT {quote(column)}, _row FROM {t} WHERE {quote(column)} != ''")
+                    self.key_index[sheet] = {str(k): n for k, n in cur.fetchall()}
+                row_num = self.key_index[sheet].get(str(key))
+                if row_num is None:
+                    return None
+                found = self.conn.execute(
+                    f"SELECT {quote(column)}, _hash FROM {t} WHERE _row = ?", (row_num,)
+                ).fetchone()
+                if found is not None and str(found[0]) == str(key):
+                    return row_num, found[1]
+                self.key_index.pop(sheet, None)
+        return None
+
+    # Table names in sql are written as {Sheet Name}, e.g. SELECT * FROM {Transaction}
+    def query(self, sql, params=()):
+        sql = re.sub(r"\{([^}]+)\}", lambda m: quote(table_name(m.group(1))), sql)
+        with self.lock:
+            return pd.read_sql_query(sql, self.conn, params=params)
+
+
+@st.cache_resource(show_spinner=False)
+def get_mirror(path=MIRROR_PATH):
+    mirror = Mirror(path)
+    mirror.register(SHEET, MonthlyRollup())
+    mirror.register(SHEET, BalanceCheckpoints())
+    return mirror
@@ -0,0 +1,293 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+
+import gspread
+import requests
+import streamlit as st
+
+import partitions
+import tracing
+from ledger import row_runs
+from mirror import MIRROR_PATH, READ_OPTS, get_mirror, normalize_row, row_hash
+from sheets import appended_start_row, is_auth_error
+
+# --- CONFIGURATION ---
+RETRY_BASE_DELAY = 2  # seconds before the first retry, doubled on every failure
+RETRY_MAX_DELAY = 300
+MAX_ATTEMPTS = 8  # after this many failures an entry is marked failed, even if retryable
+POLL_INTERVAL = 5  # seconds the worker sleeps when the queue is empty
+KEEP_SYNCED = 50  # synced entries kept around for the status list
+
+
+class WriteConflict(Exception):
+    pass
+
+
+def is_retryable(e):
+    if is_auth_error(e):
+        return True
+    if isinstance(e, gspread.exceptions.APIError):
+        code = e.response.status_code if e.response is not None else 0
+        return code == 429 or code >= 500
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    return not isinstance(e, (ValueError, TypeError, WriteConflict, gspread.exceptions.GSpreadException))
+
+
+# --- WRITE OUTBOX ---
+# Every write the UI makes is recorded here first (same SQLite file as the mirror) and the
+# mirror/snapshots are patched right away. A background thread pushes entries to the sheet
+# strictly in order, so row numbers in queued updates/deletes stay valid.
+class Outbox:
+    def __init__(self, path, mirror):
+        self.mirror = mirror
+        self.lock = threading.RLock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.sheets = None
+        self.thread = None
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL, sheet TEXT, op TEXT, payload TEXT, "
+            "summary TEXT, user TEXT, status TEXT DEFAULT 'pending', attempts INTEGER DEFAULT 0, "
+            "next_attempt_at REAL DEFAULT 0, last_error TEXT, synced_at REAL)"
+        )
+        self.conn.commit()
+
+    def start(self, sheets):
+        self.sheets = sheets
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="sheets-outbox", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+    # --- QUEUE ---
+    def enqueue(self, sheet, op, payload, summary="", user=""):
+        with self.lock:
+            cur = self.conn.execute(
+                "INSERT INTO outbox (created_at, sheet, op, payload, summary, user) VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), sheet, op, json.dumps(payload, default=str), summary, user),
+            )
+            self.conn.commit()
+        self.wake.set()
+        return cur.lastrowid
+
+    # Writes still to be pushed. Failed entries don't count: the sheet they failed on was
+    # marked stale, so a full sync shows what it really holds. Archive sheets count the hot
+    # sheet's queue too: a queued archive moves rows into them
+    def has_pending(self, sheet=None):
+        with self.lock:
+            if sheet is None:
+                row = self.conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()
+            else:
+                row = self.conn.execute(
+                    "SELECT COUNT(*) FROM outbox WHERE status = 'pending' AND sheet IN (?, ?)",
+                    (sheet, partitions.hot_sheet(sheet)),
+                ).fetchone()
+        return row[0] > 0
+
+    def recent(self, limit=20):
+        with self.lock:
+            cur = self.conn.execute(
+                "SELECT id, created_at, sheet, op, summary, user, status, attempts, last_error "
+                "FROM outbox ORDER BY id DESC LIMIT ?", (limit,)
+            )
+            names = [d[0] for d in cur.description]
+            return [dict(zip(names, r)) for r in cur.fetchall()]
+
+    def retry(self, entry_id):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = 0 WHERE id = ?", (entry_id,)
+            )
+            self.conn.commit()
+        self.wake.set()
+
+    def discard(self, entry_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT sheet, op, payload FROM outbox WHERE id = ? AND status = 'failed'", (entry_id,)
+            ).fetchone()
+            if row is None:
+                return
+            self.conn.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+            self.conn.commit()
+        # The mirror already shows the discarded write; read the real state back from the sheet
+        self._resync(row[0], row[1], json.loads(row[2]))
+
+    # An archive also moved rows into its target's mirror table: read that sheet back too, or,
+    # if it was never created, drop the table so the year isn't counted twice once the hot
+    # sheet brings the rows back
+    def _resync(self, sheet, op, payload):
+        self.mirror.mark_stale(sheet)
+        if op == "archive":
+            if self.sheets is not None and payload["target"] in self.sheets.titles():
+                self.mirror.mark_stale(payload["target"])
+            else:
+                self.mirror.drop(payload["target"])
+
+    def _next_entry(self):
+        with self.lock:
+            cur = self.conn.execute(
+                "SELECT id, sheet, op, payload, attempts, next_attempt_at FROM outbox "
+                "WHERE status = 'pending' ORDER BY id LIMIT 1"
+            )
+            row = cur.fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "sheet": row[1], "op": row[2], "payload": json.loads(row[3]),
+                "attempts": row[4], "next_attempt_at": row[5]}
+
+    # --- WORKER ---
+    def run(self):
+        while not self.stopped.is_set():
+            entry = self._next_entry()
+            if entry is None:
+                self.wake.wait(POLL_INTERVAL)
+                self.wake.clear()
+                continue
+            # Head of the queue waits out its backoff; later entries must not overtake it
+            delay = entry["next_attempt_at"] - time.time()
+            if delay > 0:
+                self.wake.wait(delay)
+                self.wake.clear()
+                continue
+            try:
+                with tracing.span(f"outbox.{entry['op']}", sheet=entry["sheet"], entry=entry["id"]):
+                    self.apply(entry)
+            except Exception as e:
+                self._failed(entry, e)
+            else:
+                self._synced(entry)
+
+    def apply(self, entry):
+        ws = self.sheets.worksheet(entry["sheet"])
+        payload = entry["payload"]
+        if entry["op"] == "append":
+            rows = payload["rows"]
+            if entry["attempts"] and payload.get("id_col"):
+                # An earlier attempt may have reached the sheet before failing (a dropped
+                # connection, a timeout): only send the rows whose ID isn't there yet
+                pos = payload["id_col"] - 1
+                written = {str(v) for v in ws.col_values(payload["id_col"])}
+                rows = [r for r in rows if str(r[pos]) not in written]
+                if len(rows) < len(payload["rows"]):
+                    self.mirror.mark_stale(entry["sheet"])
+                if not rows:
+                    return
+            response = ws.append_rows(rows, table_range="A1")
+            updates = response.get("updates", {})
+            if updates.get("updatedRows") != len(rows):
+                # Not retried: the rows may be half written and a second append would duplicate them
+                raise ValueError("Append could not be confirmed, check History against the sheet")
+            if payload.get("start_row") and appended_start_row(response) != payload["start_row"]:
+                # Landed somewhere other than where the mirror put it: resync that sheet
+                self.mirror.mark_stale(entry["sheet"])
+        elif entry["op"] == "update":
+            row = self._check_version(ws, entry["sheet"], payload)
+            last_col = gspread.utils.rowcol_to_a1(row, len(payload["values"]))
+            ws.update(range_name=f"A{row}:{last_col}", values=[payload["values"]])
+        elif entry["op"] == "delete":
+            ws.delete_rows(self._check_version(ws, entry["sheet"], payload))
+        elif entry["op"] == "batch":
+            ws.batch_update(payload["data"])
+        elif entry["op"] == "archive":
+            self._archive(ws, payload)
+        else:
+            raise ValueError(f"Unknown outbox op {entry['op']}")
+
+    # Compare-and-swap for edits/deletes that carry a row version: read just the target row
+    # and make sure it is still the transaction (and the content) the user saw. If rows moved
+    # under us, find the ID in its column instead of the whole ledger.
+    def _check_version(self, ws, sheet, payload):
+        row = payload["row"]
+        if not payload.get("version"):
+            return row
+        last_col = gspread.utils.rowcol_to_a1(row, payload["width"]).rstrip("0123456789")
+        current = ws.get(f"A{row}:{last_col}{row}", **READ_OPTS)
+        if current and row_hash(normalize_row(current[0], payload["width"])) == payload["version"]:
+            return row
+        if payload.get("id") and payload.get("id_col"):
+            ids = [str(v) for v in ws.col_values(payload["id_col"])]
+            if payload["id"] in ids:
+                row = ids.index(payload["id"]) + 1
+                current = ws.get(f"A{row}:{last_col}{row}", **READ_OPTS)
+                if current and row_hash(normalize_row(current[0], payload["width"])) == payload["version"]:
+                    self.mirror.mark_stale(sheet)
+                    return row
+        self.mirror.mark_stale(sheet)
+        raise WriteConflict("The row was changed or removed on the sheet since it was opened; nothing was written")
+
+    # Copies a closed year into its archive sheet, then deletes it from the hot sheet. Both
+    # steps go by transaction ID, so a retry after a partial run neither copies rows twice nor
+    # deletes rows that moved in the meantime.
+    def _archive(self, ws, payload):
+        target = self.sheets.add_worksheet(payload["target"], len(payload["header"]))
+        rows = payload["rows"]
+        if payload.get("target_id_col"):
+            pos = payload["target_id_col"] - 1
+            copied = {str(v) for v in target.col_values(payload["target_id_col"])}
+            rows = [r for r in rows if str(r[pos]) not in copied]
+            if not copied:
+                rows = [payload["header"]] + rows
+        if rows:
+            target.append_rows(rows, table_range="A1")
+        ids = set(payload["ids"])
+        found = [i + 1 for i, v in enumerate(ws.col_values(payload["id_col"])) if str(v) in ids]
+        # Bottom-up, one request per run of consecutive rows (a year is mostly one run)
+        for run in reversed(row_runs(found)):
+            ws.delete_rows(run[0], run[-1])
+        # The mirror put the rows after the archive's last known row; read it back to be sure,
+        # and the hot sheet too in case an earlier failed attempt brought the rows back there
+        self.mirror.mark_stale(payload["target"])
+        self.mirror.mark_stale(ws.title)
+
+    def _synced(self, entry):
+        with self.lock:
+            self.conn.execute(
+                "UPDATE outbox SET status = 'synced', synced_at = ?, last_error = NULL WHERE id = ?",
+                (time.time(), entry["id"]),
+            )
+            self.conn.execute(
+                "DELETE FROM outbox WHERE status = 'synced' AND id NOT IN "
+                "(SELECT id FROM outbox WHERE status = 'synced' ORDER BY id DESC LIMIT ?)", (KEEP_SYNCED,)
+            )
+            self.conn.commit()
+
+    def _failed(self, entry, e):
+        if is_auth_error(e):
+            try:
+                self.sheets.connect()
+            except Exception:
+                pass
+        attempts = entry["attempts"] + 1
+        if is_retryable(e) and attempts < MAX_ATTEMPTS:
+            delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+            status, next_at = "pending", time.time() + delay + random.uniform(0, delay / 2)
+        else:
+            # Needs a human (or kept failing): retried or discarded from the sync list, later
+            # entries carry on. Until then the mirror goes back to what the sheet holds.
+            status, next_at = "failed", 0
+            self._resync(entry["sheet"], entry["op"], entry["payload"])
+        with self.lock:
+            self.conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (status, attempts, next_at, str(e)[:500], entry["id"]),
+            )
+            self.conn.commit()
+
+
+# Same file and the same shared Mirror as everyone else (get_mirror() with no arguments, so
+# st.cache_resource hands back that one instance)
+@st.cache_resource(show_spinner=False, on_release=lambda outbox: outbox.stop())
+def get_outbox():
+    return Outbox(MIRROR_PATH, get_mirror())
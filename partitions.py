@@ -0,0 +1,94 @@
+import re
+from datetime import timedelta
+
+import tracing
+from ledger import ID_COLUMN, SHEET as HOT_SHEET
+from rollup import parse_dates
+
+# --- CONFIGURATION ---
+ARCHIVE_GRACE_DAYS = 31  # a year is archived once it has been over this long (late December entries)
+ARCHIVE_TTL = 3600  # seconds between syncs of an archive sheet; they only change when a year is archived
+ARCHIVE_NAME = re.compile(r"^(.+) (\d{4})$")  # "Transaction 2024"
+
+
+# --- YEARLY PARTITIONS ---
+# The Transaction sheet (the "hot" sheet) only holds the open year. Once a year is closed its
+# rows move to their own sheet, "Transaction <year>", and the hot sheet's reads, row counts
+# and row deletes stay the size of one year. The mirror keeps every partition as its own
+# table and feeds them all to the same derived tables (monthly rollup, balance checkpoints),
+# so monthly performance and balances see every year without knowing about partitions;
+# history pages through the hot table first and only reaches into archives when asked to.
+def archive_name(year):
+    return f"{HOT_SHEET} {year}"
+
+
+# Year of an archive sheet, or None for any other sheet
+def archive_year(sheet):
+    match = ARCHIVE_NAME.match(sheet)
+    return int(match.group(2)) if match and match.group(1) == HOT_SHEET else None
+
+
+# The sheet whose hooks, keys and write queue a sheet shares: archives share the hot sheet's
+def hot_sheet(sheet):
+    return HOT_SHEET if archive_year(sheet) is not None else sheet
+
+
+# Archive sheets among the given names, newest year first
+def archives(names):
+    return sorted((n for n in names if archive_year(n) is not None), key=archive_year, reverse=True)
+
+
+# The hot sheet, then archives newest first, skipping years outside [start, end]
+def partitions(names, start=None, end=None):
+    first = int(str(start)[:4]) if start else None
+    last = int(str(end)[:4]) if end else None
+    return [HOT_SHEET] + [
+        n for n in archives(names)
+        if (first is None or archive_year(n) >= first) and (last is None or archive_year(n) <= last)
+    ]
+
+
+def closed_years(mirror, today):
+    if mirror.row_count(HOT_SHEET) == 0:
+        return []
+    # Distinct dates are a few hundred values a year, not one per row
+    dates = parse_dates(mirror.query('SELECT DISTINCT "Date" FROM {Transaction}')["Date"])
+    open_year = (today - timedelta(days=ARCHIVE_GRACE_DAYS)).year
+    return sorted(int(y) for y in dates.dt.year.dropna().unique() if y < open_year)
+
+
+# Moves one year from the hot sheet to its archive sheet: the mirror right away, the sheet
+# through the outbox ("archive" op, which creates the archive sheet if needed). Rows are
+# matched by ID on the sheet, so every row must have one (ledger.ensure_ids runs first).
+@tracing.traced("partitions.archive_year")
+def archive(mirror, outbox, year, user=""):
+    header = mirror.columns(HOT_SHEET)
+    if ID_COLUMN not in header:
+        return 0
+    ledger = mirror.query('SELECT _row, "Date", "ID" FROM {Transaction} ORDER BY _row')
+    moving = ledger[parse_dates(ledger["Date"]).dt.year == year]
+    if moving.empty or (moving["ID"].fillna("") == "").any():
+        return 0
+    target = archive_name(year)
+    target_header = mirror.columns(target) or header
+    rows = mirror.rows(HOT_SHEET, moving["_row"].tolist(), target_header)
+    outbox.enqueue(HOT_SHEET, "archive", {
+        "target": target,
+        "header": target_header,
+        "rows": rows,
+        "ids": moving["ID"].astype(str).tolist(),
+        "id_col": header.index(ID_COLUMN) + 1,
+        "target_id_col": target_header.index(ID_COLUMN) + 1 if ID_COLUMN in target_header else None,
+    }, f"Archive {year} ({len(rows)} transactions)", user)
+    mirror.move_rows(HOT_SHEET, target, moving["_row"].tolist())
+    return len(rows)
+
+
+# {year: rows moved}
+def archive_closed_years(mirror, outbox, today, user=""):
+    archived = {}
+    for year in closed_years(mirror, today):
+        moved = archive(mirror, outbox, year, user)
+        if moved:
+            archived[year] = moved
+    return archived
@@ -0,0 +1,111 @@
+import pandas as pd
+
+import tracing
+
+NON_SPEND_CATEGORIES = ("Income", "Transfer")
+
+
+# ISO dates (what the app writes) parse in one vectorized pass; anything else typed into the
+# sheet by hand is parsed value by value, so a row parses the same alone or in a batch.
+def parse_dates(values):
+    values = pd.Series(values)
+    dates = pd.to_datetime(values, format="%Y-%m-%d", errors="coerce")
+    rest = dates.isna() & values.astype(str).str.strip().ne("")
+    if rest.any():
+        dates[rest] = pd.to_datetime(values[rest].astype(str), format="mixed", errors="coerce")
+    return dates
+
+
+def parse_amounts(values):
+    cleaned = pd.Series(values).astype(str).str.replace(r"[$,\s]", "", regex=True)
+    return pd.to_numeric(cleaned, errors="coerce").fillna(0)
+
+
+# --- MONTHLY ROLLUP INDEX ---
+# Totals per (year, month, owner, category) in cents, kept next to the mirrored Transaction
+# rows. The mirror hands every removed/added row to change(), so the index moves by deltas
+# and Tab 3 reads a handful of rows instead of rescanning the ledger.
+class MonthlyRollup:
+    def attach(self, mirror, sheet):
+        exists = mirror.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'monthly_rollup'"
+        ).fetchone()
+        mirror.conn.execute(
+            "CREATE TABLE IF NOT EXISTS monthly_rollup (year INTEGER, month INTEGER, owner TEXT, category TEXT, "
+            "total_cents INTEGER, txn_count INTEGER, PRIMARY KEY (year, month, owner, category))"
+        )
+        if not exists:
+            # First run against an existing mirror: build once from the rows already there
+            df = mirror.frame(sheet)
+            if not df.empty:
+                self._apply(mirror.conn, df, 1)
+
+    def change(self, conn, header, removed, added):
+        if removed:
+            self._apply(conn, pd.DataFrame(removed, columns=header), -1)
+        if added:
+            self._apply(conn, pd.DataFrame(added, columns=header), 1)
+
+    def _apply(self, conn, df, sign):
+        if "Date" not in df.columns or "Amount" not in df.columns:
+            return
+        dates = parse_dates(df["Date"])
+        keyed = pd.DataFrame({
+            "year": dates.dt.year,
+            "month": dates.dt.month,
+            "owner": df["Owner"].astype(str) if "Owner" in df.columns else "",
+            "category": df["Category"].astype(str) if "Category" in df.columns else "",
+            "cents": (parse_amounts(df["Amount"]) * 100).round().astype("int64"),
+        })[dates.notna()]
+        if keyed.empty:
+            return
+        grouped = keyed.groupby(["year", "month", "owner", "category"], as_index=False).agg(
+            total=("cents", "sum"), n=("cents", "size")
+        )
+        conn.executemany(
+            "INSERT INTO monthly_rollup VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (year, month, owner, category) DO UPDATE SET "
+            "total_cents = total_cents + excluded.total_cents, txn_count = txn_count + excluded.txn_count",
+            [
+                (int(r.year), int(r.month), r.owner, r.category, sign * int(r.total), sign * int(r.n))
+                for r in grouped.itertuples(index=False)
+            ],
+        )
+        conn.execute("DELETE FROM monthly_rollup WHERE txn_count <= 0")
+
+
+# --- QUERIES ---
+@tracing.traced("rollup.available_months")
+def available_months(mirror):
+    df = mirror.query("SELECT DISTINCT year, month FROM monthly_rollup ORDER BY year DESC, month DESC")
+    return list(zip(df["year"].astype(int), df["month"].astype(int)))
+
+
+@tracing.traced("rollup.monthly_trend")
+def monthly_trend(mirror, year, month, months=12, owner=None):
+    end = year * 12 + (month - 1)
+    start = end - months + 1
+    sql = (
+        "SELECT year, month, "
+        "SUM(CASE WHEN category = 'Income' THEN total_cents ELSE 0 END) AS gain, "
+        "SUM(CASE WHEN category NOT IN (?, ?) THEN total_cents ELSE 0 END) AS spend "
+        "FROM monthly_rollup WHERE year * 12 + month - 1 BETWEEN ? AND ?"
+    )
+    params = [*NON_SPEND_CATEGORIES, start, end]
+    if owner:
+        sql += " AND owner = ?"
+        params.append(owner)
+    df = mirror.query(sql + " GROUP BY year, month", params)
+
+    index = [f"{m // 12}-{m % 12 + 1:02d}" for m in range(start, end + 1)]
+    df.index = [f"{int(y)}-{int(m):02d}" for y, m in zip(df["year"], df["month"])]
+    trend = pd.DataFrame(index=index)
+    trend["Gain"] = df["gain"].reindex(index).fillna(0) / 100
+    trend["Spend"] = df["spend"].reindex(index).fillna(0) / 100
+    trend["Net"] = trend["Gain"] - trend["Spend"]
+    return trend
+
+
+def month_totals(mirror, year, month, owner=None):
+    row = monthly_trend(mirror, year, month, 1, owner).iloc[0]
+    return row["Gain"], row["Spend"], row["Net"]
@@ -0,0 +1,120 @@
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import gspread
+import streamlit as st
+
+# --- CONFIGURATION ---
+# Sheets allows 60 read and 60 write requests per minute per user (the service account)
+READS_PER_MINUTE = 60
+WRITES_PER_MINUTE = 60
+BURST = 10  # requests that may go out back to back before the rate applies
+MAX_RETRIES = 5  # 429s retried per call before the error reaches the caller
+RETRY_BASE_DELAY = 1  # seconds, doubled on every retry
+RETRY_MAX_DELAY = 32
+
+
+def is_quota_error(e):
+    if not isinstance(e, gspread.exceptions.APIError):
+        return False
+    code = e.response.status_code if e.response is not None else e.code
+    return code == 429
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Blocks until a request may go out; returns the seconds spent waiting
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    # After a 429 the quota is spent for everyone; make every caller wait for fresh tokens
+    def drain(self):
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+
+# --- SHEETS API SCHEDULER ---
+# Every Sheets request in the process goes through call(): it waits for a token from the read
+# or write bucket, retries 429s with exponential backoff and jitter, and lets identical reads
+# that overlap in time (two sessions loading the same sheet) share one request. Shared results
+# are the same objects for every caller, so they must be treated as read-only.
+class Scheduler:
+    def __init__(self, reads_per_minute=READS_PER_MINUTE, writes_per_minute=WRITES_PER_MINUTE, burst=BURST):
+        self.buckets = {"read": TokenBucket(reads_per_minute, burst), "write": TokenBucket(writes_per_minute, burst)}
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.coalesced = 0
+        self.retries = 0
+
+    def call(self, kind, fn, *args, coalesce_key=None, stats=None, **kwargs):
+        if coalesce_key is None:
+            return self._run(kind, fn, args, kwargs, stats)
+        with self.lock:
+            future = self.inflight.get(coalesce_key)
+            leader = future is None
+            if leader:
+                future = self.inflight[coalesce_key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            if stats is not None:
+                stats["coalesced"] = True
+            return future.result()
+        try:
+            result = self._run(kind, fn, args, kwargs, stats)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                self.inflight.pop(coalesce_key, None)
+
+    def _run(self, kind, fn, args, kwargs, stats):
+        bucket = self.buckets[kind]
+        for attempt in range(MAX_RETRIES + 1):
+            waited = bucket.acquire()
+            if stats is not None and waited:
+                stats["throttled_ms"] = round(stats.get("throttled_ms", 0) + waited * 1000, 1)
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if not is_quota_error(e) or attempt == MAX_RETRIES:
+                    raise
+                bucket.drain()
+                delay = min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY)
+                with self.lock:
+                    self.retries += 1
+                if stats is not None:
+                    stats["retries"] = attempt + 1
+                time.sleep(delay + random.uniform(0, delay / 2))
+
+
+@st.cache_resource(show_spinner=False)
+def get_scheduler():
+    return Scheduler()
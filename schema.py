@@ -0,0 +1,65 @@
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import tracing
+from ledger import SHEET
+from rollup import parse_amounts, parse_dates
+
+# --- TYPED LEDGER FRAMES ---
+# The Transaction sheet comes out of the mirror as text and mixed number/text cells. It is
+# typed once, when the shared frame is built: Date as datetime64, Amount as int64 cents (in a
+# "Cents" column, so nothing mistakes it for dollars), the low-cardinality text columns as
+# categoricals. Tabs work on this frame and never re-parse; totals add whole cents.
+CATEGORY_COLUMNS = ["Owner", "From", "To", "Category"]
+
+
+def to_cents(values):
+    return (parse_amounts(values) * 100).round().astype("int64")
+
+
+# One amount from a form, e.g. 12.345 -> 1235
+def cents_of(amount):
+    return int(round(float(amount) * 100))
+
+
+def dollars(cents):
+    return cents / 100
+
+
+@tracing.traced("schema.typed_ledger")
+def typed_ledger(df):
+    if "Amount" not in df.columns:
+        return df
+    typed = {}
+    for col in df.columns:
+        if col == "Date":
+            typed[col] = parse_dates(df[col])
+        elif col == "Amount":
+            typed["Cents"] = to_cents(df[col])
+        elif col.startswith("_"):
+            typed[col] = df[col]  # mirror bookkeeping (_row, _hash) stays as it is
+        elif col in CATEGORY_COLUMNS:
+            typed[col] = df[col].fillna("").astype(str).astype("category")
+        else:
+            typed[col] = df[col].fillna("").astype(str)
+    return pd.DataFrame(typed, index=df.index)
+
+
+# Stacks typed frames; categoricals with different categories are merged instead of falling
+# back to object columns
+def concat(frames):
+    frames = [f for f in frames if len(f.columns)]
+    out = pd.concat(frames, ignore_index=True)
+    for col in CATEGORY_COLUMNS:
+        parts = [f[col] for f in frames if col in f.columns]
+        if len(parts) == len(frames) and all(isinstance(p.dtype, pd.CategoricalDtype) for p in parts):
+            out[col] = union_categoricals(parts, ignore_order=True)
+    return out
+
+
+def replace_row(df, idx, row_df):
+    return concat([df.iloc[:idx], row_df, df.iloc[idx + 1:]])
+
+
+# Typed frame per sheet; sheets not listed are used as they come from the mirror
+TYPERS = {SHEET: typed_ledger}
@@ -0,0 +1,181 @@
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+import gspread
+import streamlit as st
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+from oauth2client.service_account import ServiceAccountCredentials
+
+import tracing
+from scheduler import get_scheduler
+
+# --- CONFIGURATION ---
+SCOPE = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)  # refresh this long before the token expires
+HEALTH_CHECK_INTERVAL = 60  # seconds between token checks
+MISSING_RECHECK_INTERVAL = 300  # seconds before listing the worksheets again for one that wasn't there
+READ_METHODS = {"get_all_values", "get_all_records", "get", "batch_get", "row_values", "col_values", "acell", "cell"}
+
+
+# e.g. {"updates": {"updatedRange": "'Transaction'!A120:G121", ...}} -> 120
+def appended_start_row(response):
+    match = re.search(r"![A-Z]+(\d+)", response.get("updates", {}).get("updatedRange", ""))
+    return int(match.group(1)) if match else None
+
+
+def is_auth_error(e):
+    if isinstance(e, RefreshError):
+        return True
+    if isinstance(e, gspread.exceptions.APIError):
+        return e.response is not None and e.response.status_code in (401, 403)
+    return False
+
+
+# --- SHARED CLIENT ---
+# One authorized client per server process. Jimmy's and Lily's sessions share the same
+# HTTP session (pooled connections), the same token and the same worksheet handles.
+class SheetsClient:
+    def __init__(self, creds_dict, sheet_name, sheet_key=None):
+        self.creds_dict = creds_dict
+        self.sheet_name = sheet_name
+        self.sheet_key = sheet_key
+        self.lock = threading.RLock()
+        self.worksheets = {}
+        self.listing = None
+        self.listed_at = 0.0
+        self.last_check = 0.0
+        self.connect()
+
+    def connect(self):
+        with self.lock, tracing.span("sheets.connect"):
+            creds = ServiceAccountCredentials.from_json_keyfile_dict(self.creds_dict, SCOPE)
+            self.client = gspread.authorize(creds)
+            if self.sheet_key:
+                self.spreadsheet = get_scheduler().call("read", self.client.open_by_key, self.sheet_key)
+            else:
+                # Only the very first connect pays for the lookup by name; rebuilds reuse the key
+                self.spreadsheet = get_scheduler().call("read", self.client.open, self.sheet_name)
+                self.sheet_key = self.spreadsheet.id
+            self.worksheets = {}
+            self.listing = None
+            self.last_check = time.monotonic()
+
+    def refresh_token(self):
+        http_client = getattr(self.client, "http_client", None)
+        auth = getattr(http_client, "auth", None)
+        if auth is None:
+            return
+        expiry = auth.expiry
+        if auth.token is None or expiry is None or expiry - datetime.utcnow() < TOKEN_REFRESH_MARGIN:
+            with tracing.span("sheets.refresh_token"):
+                auth.refresh(Request(http_client.session))
+
+    def health_check(self):
+        with self.lock:
+            if time.monotonic() - self.last_check < HEALTH_CHECK_INTERVAL:
+                return
+            try:
+                self.refresh_token()
+                self.last_check = time.monotonic()
+            except Exception as e:
+                if not is_auth_error(e):
+                    raise
+                self.connect()
+
+    # One request lists every worksheet (and gives their handles), instead of a lookup per
+    # sheet. The listing is kept until reconnecting or forget_listing().
+    def _listing(self, refresh=False):
+        if self.listing is None or refresh:
+            with tracing.span("sheets.worksheets") as attrs:
+                found = get_scheduler().call("read", self.spreadsheet.worksheets, stats=attrs)
+            self.listing = {ws.title: ws for ws in found}
+            self.listed_at = time.monotonic()
+        return self.listing
+
+    def titles(self):
+        with self.lock:
+            return list(self._listing())
+
+    def forget_listing(self):
+        with self.lock:
+            self.listing = None
+
+    def worksheet(self, name):
+        with self.lock:
+            if name not in self.worksheets:
+                listing = self._listing()
+                # Optional sheets (Frequent Transactions, Category Rules) may not exist; don't list
+                # the spreadsheet again on every rerun
+                if name not in listing and time.monotonic() - self.listed_at >= MISSING_RECHECK_INTERVAL:
+                    listing = self._listing(refresh=True)
+                if name not in listing:
+                    raise gspread.exceptions.WorksheetNotFound(name)
+                # Every call made on the handle (by the mirror or the outbox) is scheduled and timed
+                self.worksheets[name] = ScheduledWorksheet(listing[name])
+            return self.worksheets[name]
+
+    # Values of ranges on any of the sheets ("'Accounts'!A1:D1", or "'Accounts'" for all of it)
+    # in one request, one grid per range. Rows come back ragged: the API leaves out trailing
+    # empty cells, and a range with nothing in it has no values at all.
+    def batch_get(self, ranges, value_render_option=None, date_time_render_option=None):
+        params = {"valueRenderOption": value_render_option, "dateTimeRenderOption": date_time_render_option}
+        key = (self.sheet_key, "values_batch_get", repr(ranges), repr(params))
+        with tracing.span("sheets.values_batch_get", ranges=len(ranges)) as attrs:
+            response = get_scheduler().call(
+                "read", self.spreadsheet.values_batch_get, ranges,
+                params={k: v for k, v in params.items() if v is not None}, coalesce_key=key, stats=attrs,
+            )
+            grids = [vr.get("values", []) for vr in response.get("valueRanges", [])]
+            attrs["rows"] = sum(len(g) for g in grids)
+            attrs["cells"] = tracing.cell_count(grids)
+        return grids
+
+    # Returns the worksheet, adding it (one row, the given width) if the spreadsheet has none
+    def add_worksheet(self, name, cols):
+        with self.lock:
+            try:
+                return self.worksheet(name)
+            except gspread.exceptions.WorksheetNotFound:
+                pass
+            with tracing.span("sheets.add_worksheet", sheet=name) as attrs:
+                ws = get_scheduler().call("write", self.spreadsheet.add_worksheet, name, 1, cols, stats=attrs)
+            self.listing[name] = ws
+            self.worksheets[name] = ScheduledWorksheet(ws)
+            return self.worksheets[name]
+
+
+# Wraps a gspread worksheet so every API method call goes through the shared scheduler and
+# becomes a "sheets.<method>" span. Identical reads in flight at the same time share a request.
+class ScheduledWorksheet:
+    def __init__(self, ws):
+        self._ws = ws
+
+    def __getattr__(self, attr):
+        value = getattr(self._ws, attr)
+        if attr.startswith("_") or not callable(value):
+            return value
+        kind = "read" if attr in READ_METHODS else "write"
+
+        @wraps(value)
+        def call(*args, **kwargs):
+            key = (self._ws.id, attr, repr(args), repr(sorted(kwargs.items()))) if kind == "read" else None
+            with tracing.span(f"sheets.{attr}", sheet=self._ws.title) as attrs:
+                sent = kwargs.get("values", kwargs.get("data", args[0] if args and isinstance(args[0], list) else None))
+                if kind == "write" and sent is not None:
+                    attrs["cells"] = tracing.cell_count(sent)
+                result = get_scheduler().call(kind, value, *args, coalesce_key=key, stats=attrs, **kwargs)
+                if isinstance(result, list):
+                    attrs["rows"] = len(result) if attr != "batch_get" else sum(len(g) for g in result)
+                    attrs["cells"] = tracing.cell_count(result)
+                return result
+        return call
+
+
+@st.cache_resource(show_spinner=False)
+def get_sheets(sheet_name):
+    creds_dict = dict(st.secrets["gcp_service_account"])
+    return SheetsClient(creds_dict, sheet_name, st.secrets.get("sheet_key"))
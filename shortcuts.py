@@ -0,0 +1,134 @@
+import threading
+import time
+
+import streamlit as st
+
+import tracing
+from balances import OWNERS
+from mirror import get_mirror
+
+KINDS = ("spending", "income", "transfer")
+DEFAULT_OWNER = "Joint"  # shortcuts without an Owner show up under Joint
+SLOT_HOURS = 6  # usage is counted per 6-hour slot of the day (night, morning, afternoon, evening)
+SLOT_WEIGHT = 3  # a use in the current slot counts this many times more than one at another time
+
+
+def kind_of(category):
+    if category == "Income":
+        return "income"
+    if category == "Transfer":
+        return "transfer"
+    return "spending"
+
+
+def slot_of(when):
+    return when.hour // SLOT_HOURS
+
+
+# --- SHORTCUT INDEX ---
+# The Frequent Transactions sheet grouped once per data version (see store.derived): one list
+# per (owner, kind) in sheet order, plus label -> shortcut. Each shortcut is a plain dict of
+# the sheet's columns with its sheet row in "_row".
+class ShortcutIndex:
+    def __init__(self, df):
+        self.by_label = {}
+        self.groups = {(owner, kind): [] for owner in OWNERS for kind in KINDS}
+        if df.empty or "Label" not in df.columns:
+            return
+        for i, rec in enumerate(df.fillna("").to_dict("records")):
+            rec["_row"] = i + 2
+            rec["Label"] = str(rec["Label"])
+            rec["Owner"] = rec.get("Owner") or DEFAULT_OWNER
+            # The first shortcut with a label wins, as the editor always picked it
+            self.by_label.setdefault(rec["Label"], rec)
+            group = self.groups.get((rec["Owner"], kind_of(rec.get("Category", ""))))
+            if group is not None:
+                group.append(rec)
+
+    def labels(self):
+        return list(self.by_label)
+
+    def get(self, label):
+        return self.by_label.get(label)
+
+    def has_owner(self, owner):
+        return any(self.groups[(owner, kind)] for kind in KINDS)
+
+    # Most used first; ties (and unused shortcuts) keep their sheet order
+    def ranked(self, owner, kind, scores=None):
+        group = self.groups.get((owner, kind), [])
+        if not scores:
+            return group
+        return sorted(group, key=lambda rec: -scores.get(rec["Label"], 0))
+
+
+@tracing.traced("shortcuts.build_index")
+def build_index(df):
+    return ShortcutIndex(df)
+
+
+# --- USAGE COUNTERS ---
+# Quick adds per (user, shortcut label, slot of the day), kept in the mirror's database so
+# they survive restarts. The counts are loaded once and then updated in place on every
+# confirmed quick add; ranking never reads the ledger.
+class ShortcutUsage:
+    def __init__(self, mirror):
+        self.mirror = mirror
+        self.lock = threading.Lock()
+        with mirror.lock:
+            mirror.conn.execute(
+                "CREATE TABLE IF NOT EXISTS shortcut_usage (user TEXT, label TEXT, slot INTEGER, uses INTEGER, "
+                "last_used REAL, PRIMARY KEY (user, label, slot))"
+            )
+            mirror.conn.commit()
+            rows = mirror.conn.execute("SELECT user, label, slot, uses FROM shortcut_usage").fetchall()
+        self.counts = {}  # user -> {label: [uses per slot]}
+        for user, label, slot, uses in rows:
+            self._slots(user, label)[slot] = uses
+
+    def _slots(self, user, label):
+        return self.counts.setdefault(user, {}).setdefault(label, [0] * (24 // SLOT_HOURS))
+
+    def record(self, user, label, when):
+        slot = slot_of(when)
+        with self.lock:
+            self._slots(user, label)[slot] += 1
+        with self.mirror.lock:
+            self.mirror.conn.execute(
+                "INSERT INTO shortcut_usage VALUES (?, ?, ?, 1, ?) ON CONFLICT (user, label, slot) DO UPDATE SET "
+                "uses = uses + 1, last_used = excluded.last_used",
+                (user, label, slot, time.time()),
+            )
+            self.mirror.conn.commit()
+
+    # Keeps a shortcut's history when its label is edited
+    def rename(self, old, new):
+        if old == new:
+            return
+        with self.lock:
+            for labels in self.counts.values():
+                if old in labels:
+                    merged = labels.setdefault(new, [0] * (24 // SLOT_HOURS))
+                    for slot, uses in enumerate(labels.pop(old)):
+                        merged[slot] += uses
+        with self.mirror.lock:
+            self.mirror.conn.execute(
+                "INSERT INTO shortcut_usage SELECT user, ?, slot, uses, last_used FROM shortcut_usage WHERE label = ? "
+                "ON CONFLICT (user, label, slot) DO UPDATE SET uses = uses + excluded.uses, "
+                "last_used = MAX(last_used, excluded.last_used)",
+                (new, old),
+            )
+            self.mirror.conn.execute("DELETE FROM shortcut_usage WHERE label = ?", (old,))
+            self.mirror.conn.commit()
+
+    # label -> score for this user right now: all their uses, plus extra weight for this slot
+    def scores(self, user, when):
+        slot = slot_of(when)
+        with self.lock:
+            labels = self.counts.get(user, {})
+            return {label: sum(uses) + (SLOT_WEIGHT - 1) * uses[slot] for label, uses in labels.items()}
+
+
+@st.cache_resource(show_spinner=False)
+def get_usage():
+    return ShortcutUsage(get_mirror())
@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+import streamlit as st
+
+import partitions
+import schema
+import tracing
+from mirror import MIRROR_PATH, get_mirror
+
+# --- CONFIGURATION ---
+# FINANCE_SNAPSHOT_DIR moves the snapshots; by default they sit next to the mirror database
+SNAPSHOT_DIR = os.environ.get(
+    "FINANCE_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(MIRROR_PATH)), "finance_snapshots")
+)
+POLL_INTERVAL = 30  # seconds between checks when no sync asked for one
+# Column name in the typed ledger frame -> column in the snapshot
+COLUMNS = {"Date": "date", "Owner": "owner", "From": "from", "To": "to", "Category": "category",
+           "Description": "description", "Cents": "cents"}
+SCHEMA = pa.schema([
+    ("date", pa.timestamp("us")),
+    ("year", pa.int16()),
+    ("month", pa.int8()),
+    ("owner", pa.dictionary(pa.int32(), pa.string())),
+    ("from", pa.dictionary(pa.int32(), pa.string())),
+    ("to", pa.dictionary(pa.int32(), pa.string())),
+    ("category", pa.dictionary(pa.int32(), pa.string())),
+    ("description", pa.string()),
+    ("cents", pa.int64()),
+])
+
+
+# --- ARROW SNAPSHOTS ---
+# One uncompressed Arrow (Feather v2) file per ledger partition: the hot Transaction sheet and
+# each archived year. A background thread rewrites a partition's file when the mirror's
+# version of it moves (after a sync or a write), so only the open year is ever rewritten in
+# practice. Files are replaced atomically, and a manifest of row digests lets a restart keep
+# files that still match the mirror. Readers memory-map the files and read only the columns
+# they need, so multi-year analytics never go through pandas row by row or the Sheets API.
+class Snapshots:
+    def __init__(self, mirror, directory):
+        self.mirror = mirror
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.written = {}  # sheet -> mirror version the file was written (or checked) at
+        os.makedirs(directory, exist_ok=True)
+        self.manifest_path = os.path.join(directory, "manifest.json")
+        try:
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)  # sheet -> {"file", "rows", "digest"}
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name="arrow-snapshots", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+    # Cheap to call on every run: the worker only writes partitions whose version moved
+    def request(self):
+        self.wake.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wake.wait(POLL_INTERVAL)
+            self.wake.clear()
+            try:
+                self.refresh()
+            except Exception:
+                # A locked or half-synced file is tried again on the next wake
+                pass
+
+    def refresh(self):
+        with self.lock:
+            names = self.mirror.sheets()
+            for sheet in partitions.partitions(names):
+                if self.mirror.meta(sheet) is not None and self.written.get(sheet) != self.mirror.version(sheet):
+                    self._write(sheet)
+            # Partitions the mirror dropped (an archive that was never written) leave the manifest
+            gone = [sheet for sheet in self.manifest if sheet not in names]
+            for sheet in gone:
+                self.manifest.pop(sheet)
+                self.written.pop(sheet, None)
+            if gone:
+                self._save_manifest()
+
+    @tracing.traced("snapshots.write")
+    def _write(self, sheet):
+        version = self.mirror.version(sheet)
+        digest = self.mirror.digest(sheet)
+        known = self.manifest.get(sheet)
+        name = f"{sheet.replace(' ', '_')}.arrow"
+        path = os.path.join(self.directory, name)
+        if known is None or known["digest"] != digest or not os.path.exists(path):
+            table = to_arrow(schema.typed_ledger(self.mirror.frame(sheet)))
+            tmp = f"{path}.{os.getpid()}.tmp"
+            # Uncompressed, so a memory-mapped read is zero-copy
+            feather.write_feather(table, tmp, compression="uncompressed")
+            os.replace(tmp, path)
+            self.manifest[sheet] = {"file": name, "rows": table.num_rows, "digest": digest}
+            self._save_manifest()
+        self.written[sheet] = version
+        return self.manifest[sheet]["rows"]
+
+    def _save_manifest(self):
+        tmp = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp, self.manifest_path)
+
+    # (sheet, path) of the partitions that can hold rows dated within [first_year, last_year]
+    def files(self, first_year=None, last_year=None):
+        sheets = partitions.partitions(
+            list(self.manifest), first_year and f"{first_year}-01-01", last_year and f"{last_year}-12-31"
+        )
+        return [(s, os.path.join(self.directory, self.manifest[s]["file"])) for s in sheets if s in self.manifest]
+
+    # Memory-mapped read of just these columns across partitions, as one table
+    def read(self, columns, first_year=None, last_year=None):
+        tables = [feather.read_table(path, columns=columns, memory_map=True) for _, path in self.files(first_year, last_year)]
+        if not tables:
+            return SCHEMA.empty_table().select(columns)
+        # Each file has its own category dictionaries
+        return pa.concat_tables(tables).unify_dictionaries()
+
+
+def to_arrow(df):
+    if "Cents" not in df.columns:
+        return SCHEMA.empty_table()
+    table = pa.Table.from_pandas(df[list(COLUMNS)].rename(columns=COLUMNS), preserve_index=False)
+    table = table.append_column("year", pc.year(table["date"])).append_column("month", pc.month(table["date"]))
+    return table.select(SCHEMA.names).cast(SCHEMA).replace_schema_metadata(None)
+
+
+@st.cache_resource(show_spinner=False, on_release=lambda snapshots: snapshots.stop())
+def get_snapshots(directory=SNAPSHOT_DIR):
+    return Snapshots(get_mirror(), directory)
@@ -0,0 +1,235 @@
+import threading
+import time
+import weakref
+
+import pandas as pd
+import streamlit as st
+
+import partitions
+import schema
+import tracing
+from mirror import get_mirror
+from outbox import get_outbox
+from scheduler import is_quota_error
+
+QUOTA_RETRY = 30  # seconds before a sheet served from the mirror during a quota limit asks again
+
+
+# --- SHARED FRAME STORE ---
+# One copy of each worksheet frame for the whole process, shared by every session. Frames are
+# built from the SQLite mirror and tagged with the mirror's change counter for that sheet, so
+# a frame is rebuilt only when the rows actually changed. Writes patch the mirror and the
+# shared frame once, then notify the other sessions' subscriptions so they rerun against the
+# new version; nothing is read back from the sheet for that.
+class Subscription:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sheets = set()
+
+    def notify(self, sheet):
+        with self.lock:
+            self.sheets.add(sheet)
+
+    # Sheets changed by someone else since the last call
+    def take(self):
+        with self.lock:
+            sheets, self.sheets = self.sheets, set()
+        return sheets
+
+
+class SharedStore:
+    def __init__(self, mirror):
+        self.mirror = mirror
+        self.lock = threading.RLock()
+        self.frames = {}  # sheet -> {"df": DataFrame, "version": mirror version, "derived": {...}}
+        self.synced_at = {}  # sheet -> monotonic time the sheet was last synced (by any session)
+        self.subscribers = weakref.WeakSet()
+
+    def subscribe(self):
+        sub = Subscription()
+        with self.lock:
+            self.subscribers.add(sub)
+        return sub
+
+    def publish(self, sheet, source=None):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for sub in subscribers:
+            if sub is not source:
+                sub.notify(sheet)
+
+    # Returns (frame, quota_limited). The sheet is synced at most once per ttl for everyone.
+    def load(self, ws, ttl, source=None):
+        quota_limited = self.sync(ws, ttl, source)
+        return self.frame(ws.title, source), quota_limited
+
+    # Brings the sheet's mirror table up to date without building a frame; True if the sheet
+    # could not be read for quota and the mirror's copy stands in
+    def sync(self, ws, ttl, source=None):
+        return self.sync_many([(ws, ttl)], source)
+
+    # The same for several (worksheet, ttl) pairs. With fetch (see Mirror.sync_batch) every
+    # sheet that is due is read in one request, otherwise one after another. Rows pulled in
+    # from the sheet are announced to the other sessions, whether or not anyone keeps a frame.
+    def sync_many(self, entries, source=None, fetch=None):
+        due = {}
+        for ws, ttl in entries:
+            meta = self.mirror.meta(ws.title)
+            stale = meta is None or meta["stale"] or time.monotonic() - self.synced_at.get(ws.title, -ttl) > ttl
+            # While writes are still queued the sheet is behind the mirror; don't sync it back
+            if stale and not get_outbox().has_pending(ws.title):
+                due[ws.title] = (ws, ttl, meta, self.mirror.version(ws.title))
+        if not due:
+            return False
+        quota_limited = False
+        synced_at = time.monotonic()
+        try:
+            with tracing.span("mirror.sync", sheet=", ".join(due)) as attrs:
+                if fetch is not None:
+                    attrs["rows"] = sum(self.mirror.sync_batch(fetch, [ws for ws, _, _, _ in due.values()]).values())
+                else:
+                    attrs["rows"] = sum(self.mirror.sync(ws) for ws, _, _, _ in due.values())
+        except Exception as e:
+            # Out of quota even after retries: keep going on what the mirror already holds
+            if not is_quota_error(e) or any(meta is None for _, _, meta, _ in due.values()):
+                raise
+            quota_limited = True
+        for sheet, (ws, ttl, meta, version) in due.items():
+            self.synced_at[sheet] = synced_at - (ttl - QUOTA_RETRY if quota_limited else 0)
+            if meta is not None and self.mirror.version(sheet) != version:
+                self.publish(sheet, source)
+        return quota_limited
+
+    def frame(self, sheet, source=None):
+        with self.lock:
+            version = self.mirror.version(sheet)
+            entry = self.frames.get(sheet)
+            if entry is not None and entry["version"] == version:
+                return entry["df"]
+            df = self.mirror.frame(sheet)
+            # Typed once here for every session (see schema.py); archives like the hot sheet
+            typer = schema.TYPERS.get(partitions.hot_sheet(sheet))
+            self.frames[sheet] = {"df": typer(df) if typer else df, "version": version}
+        if entry is not None:
+            self.publish(sheet, source)
+        return self.frames[sheet]["df"]
+
+    # Applies patch(df) to the shared frame if it was current before the mirror write,
+    # otherwise leaves the rebuild to the next read. Other sessions are told either way.
+    def patch(self, sheet, version_before, patch, source=None):
+        with self.lock:
+            entry = self.frames.get(sheet)
+            version = self.mirror.version(sheet)
+            # Exactly our write in between: patch in place of a rebuild
+            if entry is not None and entry["version"] == version_before and version == version_before + 1:
+                df = patch(entry["df"])
+                if df is not None:
+                    self.frames[sheet] = {"df": df, "version": version}
+        self.publish(sheet, source)
+
+    # Something built from the current frame (an index, a lookup), made once per version and
+    # shared like the frame; a new version starts with none
+    def derived(self, sheet, name, build):
+        with self.lock:
+            entry = self.frames.get(sheet)
+            if entry is None:
+                return build(pd.DataFrame())
+            built = entry.setdefault("derived", {})
+            if name not in built:
+                built[name] = build(entry["df"])
+            return built[name]
+
+    def forget_sync(self, sheet=None):
+        with self.lock:
+            if sheet is None:
+                self.synced_at.clear()
+            else:
+                self.synced_at.pop(sheet, None)
+
+
+@st.cache_resource(show_spinner=False)
+def get_store():
+    return SharedStore(get_mirror())
+
+
+# --- SESSION API ---
+def subscription():
+    if "store_subscription" not in st.session_state:
+        st.session_state.store_subscription = get_store().subscribe()
+    return st.session_state.store_subscription
+
+
+def load_frame(ws, ttl):
+    df, quota_limited = get_store().load(ws, ttl, subscription())
+    if quota_limited:
+        st.session_state.quota_limited = True
+    # Shallow copy so tabs can add helper columns without touching the shared frame
+    return df.copy(deep=False)
+
+
+def derived(name, key, build):
+    return get_store().derived(name, key, build)
+
+
+# Sheets only queried through the mirror (the ledger, archives) are synced without keeping a frame
+def sync(ws, ttl):
+    if get_store().sync(ws, ttl, subscription()):
+        st.session_state.quota_limited = True
+
+
+# Several sheets at once, in a single values request (sheets: the SheetsClient); entries are
+# (worksheet, ttl) pairs. Frames loaded afterwards come straight from the mirror.
+def sync_all(sheets, entries):
+    if get_store().sync_many(entries, subscription(), sheets.batch_get):
+        st.session_state.quota_limited = True
+
+
+# Read the sheet again on the next load (everyone's, since the mirror is shared)
+def invalidate(name=None):
+    get_mirror().mark_stale(name)
+    get_store().forget_sync(name)
+
+
+def _write(name, mirror_write, patch):
+    store = get_store()
+    before = store.mirror.version(name)
+    mirror_write()
+    store.patch(name, before, patch, subscription())
+
+
+# Rows as a frame shaped (and typed) like the shared frame of that sheet
+def _rows_frame(name, rows):
+    header = get_mirror().columns(name)
+    width = len(header)
+    df = pd.DataFrame([(list(r) + [""] * width)[:width] for r in rows], columns=header)
+    typer = schema.TYPERS.get(partitions.hot_sheet(name))
+    return typer(df) if typer else df
+
+
+# Rows are lists in sheet column order, the same shape that is written to the sheet.
+def append_rows(name, rows, start_row=None):
+    def patch(df):
+        if df.empty and len(df.columns) == 0:
+            return None
+        return schema.concat([df, _rows_frame(name, rows)])
+    _write(name, lambda: get_mirror().append_rows(name, rows, start_row), patch)
+
+
+def update_row(name, sheet_row, values):
+    def patch(df):
+        idx = sheet_row - 2
+        row = get_mirror().row(name, sheet_row)
+        if idx < 0 or idx >= len(df) or row is None:
+            return None
+        # The mirror merged the new values into the row; take the whole row from there
+        return schema.replace_row(df, idx, _rows_frame(name, [[row[c] for c in get_mirror().columns(name)]]))
+    _write(name, lambda: get_mirror().update_row(name, sheet_row, values), patch)
+
+
+def delete_row(name, sheet_row):
+    def patch(df):
+        idx = sheet_row - 2
+        if idx < 0 or idx >= len(df):
+            return None
+        return df.drop(index=idx).reset_index(drop=True)
+    _write(name, lambda: get_mirror().delete_row(name, sheet_row), patch)
@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+
+# --- CONFIGURATION ---
+TRACE_ENABLED = os.environ.get("FINANCE_TRACE", "1") != "0"  # FINANCE_TRACE=0 turns the files off
+TRACE_DIR = os.environ.get("FINANCE_TRACE_DIR", os.path.dirname(os.path.abspath(__file__)))
+TRACE_PATH = os.path.join(TRACE_DIR, "finance_trace.jsonl")
+METRICS_PATH = os.path.join(TRACE_DIR, "finance_metrics.prom")
+TRACE_MAX_BYTES = 5 * 2**20  # trace file size before it rotates
+TRACE_BACKUPS = 3
+METRICS_WRITE_INTERVAL = 30  # seconds between rewrites of the Prometheus file
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # histogram bounds, seconds
+
+# --- TIMING SPANS ---
+# A span times one step (a Sheets API call, a mirror sync, a dataframe query) and carries a few
+# attributes: the sheet, rows and cells moved. Spans made while a script run is active belong to
+# that run and feed the sidebar debug panel; spans from the outbox worker are kept as
+# "background". Every span is also appended to a rotating JSONL file and folded into
+# process-wide totals that are written out in Prometheus text format.
+
+_local = threading.local()
+_lock = threading.Lock()
+_stats = {}  # span name -> totals
+_background = deque(maxlen=50)
+_metrics_written = 0.0
+_trace_log = None
+
+
+def _logger():
+    global _trace_log
+    if _trace_log is None:
+        log = logging.getLogger("finance.trace")
+        log.propagate = False
+        log.setLevel(logging.INFO)
+        if not log.handlers:
+            handler = RotatingFileHandler(TRACE_PATH, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            log.addHandler(handler)
+        _trace_log = log
+    return _trace_log
+
+
+def start_run(label="run"):
+    _local.run = {"id": uuid.uuid4().hex[:8], "label": label, "started": time.perf_counter(), "spans": []}
+    return _local.run
+
+
+def current_run():
+    return getattr(_local, "run", None)
+
+
+def finish_run(**attrs):
+    run = current_run()
+    if run is None:
+        return None
+    _local.run = None
+    _record(f"{run['label']}.run", time.perf_counter() - run["started"], dict(attrs, spans=len(run["spans"])), None, run)
+    _write_metrics(force=True)
+    return run
+
+
+def run_summary(run):
+    sheets = [s for s in run["spans"] if s["name"].startswith("sheets.")]
+    return {
+        "elapsed_ms": round((time.perf_counter() - run["started"]) * 1000, 1),
+        "spans": len(run["spans"]),
+        "sheets_calls": len(sheets),
+        "sheets_ms": round(sum(s["ms"] for s in sheets), 1),
+    }
+
+
+def background_spans():
+    with _lock:
+        return list(_background)
+
+
+@contextmanager
+def span(name, **attrs):
+    started = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _record(name, time.perf_counter() - started, attrs, error, current_run())
+
+
+# Decorator form; a DataFrame or list result records its length as "rows"
+def traced(name):
+    def wrap(fn):
+        @wraps(fn)
+        def call(*args, **kwargs):
+            with span(name) as attrs:
+                result = fn(*args, **kwargs)
+                if hasattr(result, "__len__") and not isinstance(result, (str, dict)):
+                    attrs["rows"] = len(result)
+                return result
+        return call
+    return wrap
+
+
+def _record(name, seconds, attrs, error, run):
+    entry = {"name": name, "ms": round(seconds * 1000, 2), **attrs}
+    if error:
+        entry["error"] = error
+    with _lock:
+        stats = _stats.setdefault(name, {"count": 0, "errors": 0, "seconds": 0.0, "rows": 0, "cells": 0,
+                                         "buckets": [0] * len(BUCKETS)})
+        stats["count"] += 1
+        stats["errors"] += bool(error)
+        stats["seconds"] += seconds
+        stats["rows"] += int(attrs.get("rows", 0) or 0)
+        stats["cells"] += int(attrs.get("cells", 0) or 0)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                stats["buckets"][i] += 1
+        if run is not None:
+            run["spans"].append(entry)
+        else:
+            _background.append(entry)
+    if TRACE_ENABLED:
+        line = {"ts": round(time.time(), 3), "run": run["id"] if run else "background", **entry}
+        try:
+            _logger().info(json.dumps(line, default=str))
+        except OSError:
+            pass
+        _write_metrics()
+
+
+# --- SHEETS API CALLS ---
+# Cells in a values grid (reads), a values payload (writes) or a batch_update data list
+def cell_count(obj):
+    if isinstance(obj, dict):
+        return cell_count(obj.get("values", []))
+    if isinstance(obj, (list, tuple)):
+        if obj and isinstance(obj[0], (list, tuple, dict)):
+            return sum(cell_count(v) for v in obj)
+        return len(obj)
+    return 0
+
+
+# --- PROMETHEUS TEXT ---
+def prometheus_text():
+    with _lock:
+        stats = {name: dict(s, buckets=list(s["buckets"])) for name, s in _stats.items()}
+    lines = [
+        "# HELP finance_span_seconds Time spent in instrumented steps.",
+        "# TYPE finance_span_seconds histogram",
+    ]
+    for name, s in sorted(stats.items()):
+        for bound, n in zip(BUCKETS, s["buckets"]):
+            lines.append(f'finance_span_seconds_bucket{{span="{name}",le="{bound}"}} {n}')
+        lines.append(f'finance_span_seconds_bucket{{span="{name}",le="+Inf"}} {s["count"]}')
+        lines.append(f'finance_span_seconds_sum{{span="{name}"}} {s["seconds"]:.6f}')
+        lines.append(f'finance_span_seconds_count{{span="{name}"}} {s["count"]}')
+    for metric, key, help_text in (
+        ("finance_span_errors_total", "errors", "Instrumented steps that raised."),
+        ("finance_span_rows_total", "rows", "Rows read or returned by instrumented steps."),
+        ("finance_span_cells_total", "cells", "Cells sent to or read from the Sheets API."),
+    ):
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        lines += [f'{metric}{{span="{name}"}} {s[key]}' for name, s in sorted(stats.items())]
+    return "\n".join(lines) + "\n"
+
+
+def _write_metrics(force=False):
+    global _metrics_written
+    if not TRACE_ENABLED or (not force and time.monotonic() - _metrics_written < METRICS_WRITE_INTERVAL):
+        return
+    _metrics_written = time.monotonic()
+    tmp = f"{METRICS_PATH}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w") as f:
+            f.write(prometheus_text())
+        os.replace(tmp, METRICS_PATH)
+    except OSError:
+        pass